@@ -0,0 +1,686 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the data generation and decoding pipeline.
+"""
+
+import argparse
+import csv
+import logging
+import sys
+import time
+
+logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO, datefmt='%H:%M:%S')
+logger = logging.getLogger(__name__)
+
+
+def load_game_rows(games_csv, n_games):
+    """
+    Load the first `n_games` rows from games.csv as (rotowire_game_id, sentences)
+    """
+    from nltk import sent_tokenize
+
+    rows = []
+
+    with open(games_csv) as f:
+        reader = csv.reader(f, delimiter=',', quotechar='"')
+        next(reader)
+
+        for row in reader:
+            rows.append((int(row[3]), sent_tokenize(row[4])))
+
+            if len(rows) == n_games:
+                break
+
+    return rows
+
+
+def bench_scorer(args):
+    """
+    Context retrieval for all sentences of a game with and without the per-game embedding cache
+    and with batched queries
+    """
+    from preprocess import load_games
+    from utils.sentence_scorer import SentenceScorer
+
+    games = load_games(f"./context/{args.templates}", rotowire_dir=args.rotowire_dir, split="test")
+    rows = load_game_rows(args.games, args.n_games)
+    n_sents = sum(len(sentences) for _, sentences in rows)
+
+    results = {}
+
+    for cache_size in [0, args.cache_size]:
+        ss = SentenceScorer(cache_size=cache_size)
+        start = time.perf_counter()
+
+        for game_id, sentences in rows:
+            for sent in sentences:
+                ss.retrieve_ctx_scored(sent, games[game_id], cnt=args.ctx)
+
+        results[cache_size] = time.perf_counter() - start
+        logger.info(f"cache_size={cache_size}: {results[cache_size]:.2f} s "
+                    f"({n_sents / results[cache_size]:.1f} sentences/s)")
+
+    logger.info(f"Speedup: {results[0] / results[args.cache_size]:.2f}x")
+
+    ss = SentenceScorer(cache_size=args.cache_size)
+    start = time.perf_counter()
+
+    for game_id, sentences in rows:
+        ss.retrieve_ctx_scored_batch(sentences, games[game_id], cnt=args.ctx)
+
+    elapsed = time.perf_counter() - start
+    logger.info(f"cache_size={args.cache_size}, batched: {elapsed:.2f} s "
+                f"({n_sents / elapsed:.1f} sentences/s, speedup {results[0] / elapsed:.2f}x)")
+
+
+def bench_retriever(args):
+    """
+    Latency of the context retrievers and their agreement with the dense retriever
+    """
+    from preprocess import load_games
+    from utils.sentence_scorer import get_scorer
+
+    games = load_games(f"./context/{args.templates}", rotowire_dir=args.rotowire_dir, split="test")
+    rows = load_game_rows(args.games, args.n_games)
+    n_sents = sum(len(sentences) for _, sentences in rows)
+    retrieved = {}
+
+    for retriever in ["dense", "bm25", "hybrid"]:
+        ss = get_scorer(retriever)
+        retrieved[retriever] = []
+        start = time.perf_counter()
+
+        for game_id, sentences in rows:
+            ctx_scored_batch = ss.retrieve_ctx_scored_batch(sentences, games[game_id], cnt=args.ctx)
+            retrieved[retriever] += [[x[0] for x in ctx_scored] for ctx_scored in ctx_scored_batch]
+
+        elapsed = time.perf_counter() - start
+        overlap = sum(len(set(ctx) & set(ctx_dense)) / max(len(ctx_dense), 1)
+                      for ctx, ctx_dense in zip(retrieved[retriever], retrieved["dense"])) / n_sents
+        top1 = sum(ctx[:1] == ctx_dense[:1]
+                   for ctx, ctx_dense in zip(retrieved[retriever], retrieved["dense"])) / n_sents
+
+        logger.info(f"{retriever}: {1000 * elapsed / n_sents:.1f} ms/sentence, "
+                    f"overlap@{args.ctx} with dense {overlap:.3f}, top-1 agreement {top1:.3f}")
+
+
+def bench_precision(args):
+    """
+    Memory usage of the template embeddings in reduced precision and the top-k overlap with fp32
+    """
+    import torch
+    from preprocess import load_games
+    from utils.sentence_scorer import SentenceScorer, CompactEmbeddings
+
+    games = load_games(f"./context/{args.templates}", rotowire_dir=args.rotowire_dir, split="test")
+    rows = load_game_rows(args.games, args.n_games)
+    n_sents = sum(len(sentences) for _, sentences in rows)
+    ss = SentenceScorer(cache_size=0)
+
+    nbytes = {precision : 0 for precision in CompactEmbeddings.PRECISIONS}
+    overlap = {precision : 0.0 for precision in CompactEmbeddings.PRECISIONS}
+
+    for game_id, sentences in rows:
+        texts = games[game_id].get_all()
+        cnt = min(args.ctx, len(texts))
+        emb = ss.model.encode(texts, convert_to_tensor=True, show_progress_bar=False)
+        emb_sents = ss.model.encode(sentences, convert_to_tensor=True, show_progress_bar=False)
+        top_fp32 = None
+
+        for precision in CompactEmbeddings.PRECISIONS:
+            emb_texts = CompactEmbeddings.from_tensor(emb, precision)
+            top_indices = torch.topk(emb_texts.cos_sim(emb_sents), k=cnt, dim=1).indices.tolist()
+            top_fp32 = top_fp32 or top_indices
+            nbytes[precision] += emb_texts.nbytes
+            overlap[precision] += sum(len(set(a) & set(b)) / cnt for a, b in zip(top_indices, top_fp32))
+
+    for precision in CompactEmbeddings.PRECISIONS:
+        logger.info(f"{precision}: {nbytes[precision] / len(rows) / 1024:.1f} kB/game, "
+                    f"top-{args.ctx} overlap with fp32 {overlap[precision] / n_sents:.4f}")
+
+
+def bench_ner(args):
+    """
+    Throughput of the Spacy NER: full pipeline for each sentence vs. nlp.pipe with a trimmed pipeline
+    """
+    import json
+    import os
+    import en_core_web_sm
+    from nltk import sent_tokenize
+    from utils.tokenizer import Tokenizer as Detokenizer
+
+    detokenizer = Detokenizer()
+
+    with open(os.path.join(args.rotowire_dir, f"{args.split}.json")) as f:
+        rotowire = json.load(f)[:args.n_games]
+
+    sents = [detokenizer.detokenize(sent) for game in rotowire for sent in sent_tokenize(" ".join(game["summary"]))]
+
+    nlp_full = en_core_web_sm.load()
+    start = time.perf_counter()
+    ents_full = [[(ent.text, ent.label_, ent.start, ent.end) for ent in nlp_full(sent).ents] for sent in sents]
+    elapsed_full = time.perf_counter() - start
+
+    nlp_ner = en_core_web_sm.load(disable=["tok2vec", "tagger", "parser", "attribute_ruler", "lemmatizer"])
+    start = time.perf_counter()
+    ents_ner = [[(ent.text, ent.label_, ent.start, ent.end) for ent in doc.ents] for doc in nlp_ner.pipe(sents, batch_size=256)]
+    elapsed_ner = time.perf_counter() - start
+
+    logger.info(f"Full pipeline: {len(sents) / elapsed_full:.1f} sentences/s")
+    logger.info(f"NER only, nlp.pipe: {len(sents) / elapsed_ner:.1f} sentences/s (speedup {elapsed_full / elapsed_ner:.2f}x)")
+    logger.info(f"Identical entities in {sum(a == b for a, b in zip(ents_full, ents_ner))}/{len(sents)} sentences")
+
+
+def _synthetic_rotowire(rotowire_dir, split, n_games):
+    """
+    Writes a synthetic Rotowire split with games of the same size as in the original dataset
+    """
+    import json
+    import os
+    import random
+
+    random.seed(42)
+    columns = ["PLAYER_NAME", "FIRST_NAME", "SECOND_NAME", "START_POSITION", "MIN", "PTS", "FGM", "FGA", "FG_PCT", "FG3M",
+               "FG3A", "FG3_PCT", "FTM", "FTA", "FT_PCT", "OREB", "DREB", "REB", "AST", "TO", "STL", "BLK", "PF", "TEAM_CITY"]
+    games = []
+
+    for _ in range(n_games):
+        n_players = random.randint(20, 30)
+        games.append({
+            "home_city" : "Boston", "home_name" : "Celtics", "vis_city" : "New York", "vis_name" : "Knicks",
+            "home_line" : {f"TEAM-{i}" : str(random.randint(0, 120)) for i in range(15)},
+            "vis_line" : {f"TEAM-{i}" : str(random.randint(0, 120)) for i in range(15)},
+            "box_score" : {column : {str(i) : f"{column.lower()}-{random.randint(0, 1000)}" for i in range(n_players)}
+                           for column in columns},
+            "summary" : ["The", "Boston", "Celtics", "defeated", "the", "New", "York", "Knicks", "."] * 40
+        })
+
+    os.makedirs(rotowire_dir, exist_ok=True)
+
+    with open(os.path.join(rotowire_dir, f"{split}.json"), "w") as f:
+        json.dump(games, f)
+
+
+def _startup_worker(rotowire_dir, split, variant, results):
+    """
+    Loads the entity tables of all the games in a split in a fresh process (see `bench_startup`)
+    """
+    import os
+    from preprocess import GameData
+    from utils.rotowire import Rotowire
+
+    def rss_mb():
+        # resident set size in MB (Linux)
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+    rotowire = Rotowire(rotowire_dir, split)
+    rss_before = rss_mb()
+    start = time.perf_counter()
+
+    if variant == "full records":
+        # the original GameData: each game is decoded completely to build the entity tables
+        from nltk import word_tokenize
+        from utils.utils import SubstitutionTable
+
+        games = []
+
+        for game_id in range(len(rotowire)):
+            game = rotowire._load(game_id)
+            games.append((
+                SubstitutionTable([game["home_city"] + " " + game["home_name"], game["vis_city"] + " " + game["vis_name"]], tokenize=word_tokenize),
+                SubstitutionTable(game["box_score"]["PLAYER_NAME"], tokenize=word_tokenize)
+            ))
+    else:
+        games = [GameData(game_id, rotowire) for game_id in range(len(rotowire))]
+
+        if variant == "entity records":
+            for game_data in games:
+                game_data.get_teams()
+                game_data.get_players()
+
+    elapsed = time.perf_counter() - start
+    results[variant] = (elapsed, rss_mb() - rss_before)
+
+
+def bench_startup(args):
+    """
+    Loading the games of a split: decoding the full game records vs. reading the entity records vs. lazy entity tables
+    """
+    import os
+    import tempfile
+    import multiprocessing
+    from utils.rotowire import Rotowire
+
+    rotowire_dir = args.rotowire_dir
+
+    if not os.path.exists(os.path.join(rotowire_dir, f"{args.split}.json")) and \
+            not os.path.exists(os.path.join(rotowire_dir, f"{args.split}.store")):
+        rotowire_dir = tempfile.mkdtemp()
+        logger.info(f"Rotowire split not found, using {args.n_synthetic_games} synthetic games in {rotowire_dir}")
+        _synthetic_rotowire(rotowire_dir, args.split, args.n_synthetic_games)
+
+    # the store is converted in advance, the conversion is not included in the measurement
+    Rotowire(rotowire_dir, args.split)
+
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Manager().dict()
+
+    for variant in ["full records", "entity records", "lazy tables"]:
+        # each variant in a fresh process, so that the memory is not shared
+        process = ctx.Process(target=_startup_worker, args=(rotowire_dir, args.split, variant, results))
+        process.start()
+        process.join()
+
+        elapsed, rss_mb = results[variant]
+        logger.info(f"{variant}: {elapsed:.2f} s, RSS +{rss_mb:.1f} MB")
+
+
+def modify_numbers_reference(orig_text, mode="cardinal"):
+    """
+    The original implementation of `Generator.modify_numbers` used as a reference
+    """
+    import random
+    import re
+    from num2words import num2words
+    from text_to_num import alpha2digit
+
+    orig_text = str(orig_text)
+    text = alpha2digit(orig_text, "en")
+
+    if mode == "ordinal":
+        extra_ordinals = {"first" : "1st", "second" : "2nd", "third" : "3rd"}
+        for k, v in extra_ordinals.items():
+            text = re.sub(rf"\b{k}\b", rf"{v}", text)
+
+    to_lex = (orig_text != text)
+    chars = [ch for ch in text]
+    numbers = [(m.group(0), m.start(0), m.end(0)) for m in re.finditer(r"\d+\w*", text)]
+
+    for num_str, start, end in numbers:
+        num = int(re.search(r"\d+", num_str).group(0))
+        modified_num = num
+
+        while modified_num == num:
+            modified_num = max(0, int(random.gauss(num, 3)))
+
+        if to_lex:
+            modified_num = num2words(modified_num, to=mode)
+
+        chars[start:end] = [ch for ch in str(modified_num)]
+
+    return "".join(chars)
+
+
+def bench_numbers(args):
+    """
+    Number perturbation: the memoized implementation vs. the original implementation
+    """
+    import random
+    from utils.number_perturbation import modify_numbers
+
+    inputs = [("12", "cardinal"), ("107", "cardinal"), ("14-11", "cardinal"), ("three", "cardinal"),
+              ("twenty", "cardinal"), ("88%", "cardinal"), ("39", "cardinal"), ("first", "ordinal"),
+              ("third", "ordinal"), ("fourth", "ordinal"), ("2nd", "ordinal"), ("seconds", "ordinal")]
+    random.seed(args.seed)
+    inputs = [random.choice(inputs) for _ in range(args.n_calls)]
+    results = {}
+
+    for name, fn in [("reference", modify_numbers_reference), ("memoized", modify_numbers)]:
+        random.seed(args.seed)
+        start = time.perf_counter()
+        results[name] = [fn(text, mode=mode) for text, mode in inputs]
+        elapsed = time.perf_counter() - start
+        logger.info(f"{name}: {1e6 * elapsed / args.n_calls:.1f} us/call")
+
+    logger.info(f"Identical outputs: {results['reference'] == results['memoized']}")
+
+
+def bench_json(args):
+    """
+    Writing a dataset: CompactJSONEncoder.encode vs. the streaming DatasetWriter (checks the byte-for-byte equivalence)
+    """
+    import json
+    import random
+    from utils.json_encoder import CompactJSONEncoder
+    from utils.dataset_writer import DatasetWriter
+
+    if args.dataset:
+        with open(args.dataset) as f:
+            data = json.load(f)["data"]
+    else:
+        # synthetic dataset with the size of the train split with ctx40
+        random.seed(42)
+        vocab = ["The", "Celtics", "scored", "113", "points", "Boston", "-", ",", "."]
+        data = [{
+            "ctx" : [random.choice(vocab) for _ in range(800)],
+            "sent" : [random.choice(vocab) for _ in range(25)],
+            "labels" : [random.choice(["O", "NAME", "NUMBER"]) for _ in range(25)]
+        } for _ in range(args.n_examples)]
+
+    start = time.perf_counter()
+    s_encoder = json.dumps({"data" : data}, ensure_ascii=False, indent=4, cls=CompactJSONEncoder)
+    elapsed_encoder = time.perf_counter() - start
+    logger.info(f"CompactJSONEncoder.encode: {elapsed_encoder:.2f} s")
+
+    start = time.perf_counter()
+    with DatasetWriter("/tmp/benchmark_dataset", fmt="json") as writer:
+        writer.write_all(data)
+    elapsed_writer = time.perf_counter() - start
+    logger.info(f"DatasetWriter (to file): {elapsed_writer:.2f} s (speedup {elapsed_encoder / elapsed_writer:.2f}x)")
+
+    with open(writer.path) as f:
+        identical = f.read() == s_encoder
+
+    logger.info(f"Identical output: {identical}")
+
+    if not identical:
+        sys.exit("The output of DatasetWriter differs from CompactJSONEncoder.encode")
+
+
+def align_labels_reference(tokenizer, features, labels):
+    """
+    The original implementation of `ErrorCheckerDataModule._align_labels_with_tokens` used as a reference
+    """
+    from utils.utils import Label
+
+    aligned_labels_batch = []
+    label_map = Label.label2id()
+    do_not_care_label = -100
+
+    for b in range(len(labels)):
+        aligned_labels = []
+        active = False
+        prev_input_id = None
+
+        for i, (input_id, word) in enumerate(zip(features["input_ids"][b], features.words(b))):
+            aligned_label = do_not_care_label
+
+            if active and word is not None and features.words(b)[i-1] != word:
+                aligned_label = label_map[labels[b][word]]
+
+            if prev_input_id == input_id == tokenizer.sep_token_id:
+                active = True
+
+            aligned_labels.append(aligned_label)
+            prev_input_id = input_id
+
+        aligned_labels_batch.append(aligned_labels)
+
+    return aligned_labels_batch
+
+
+def bench_align(args):
+    """
+    Preprocessing of a dataset for training: the vectorized label alignment vs. the original implementation
+    """
+    from itertools import islice
+    from transformers import AutoTokenizer
+    from utils.dataset_writer import read_examples
+    from utils.token_dataset import align_labels_with_tokens, select_ctx
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model_name, use_fast=True, add_prefix_space=True)
+    examples = list(islice(read_examples(args.dataset), args.n_examples))
+    elapsed = {"tokenization" : 0.0, "reference" : 0.0, "vectorized" : 0.0}
+    identical = True
+
+    for i in range(0, len(examples), args.batch_size):
+        batch = examples[i:i+args.batch_size]
+
+        start = time.perf_counter()
+        example_batch = {key : [x[key] for x in batch] for key in batch[0]}
+        features = tokenizer(select_ctx(example_batch), example_batch["sent"],
+            is_split_into_words=True,
+            return_offsets_mapping=True,
+            max_length=args.max_length,
+            truncation='only_first')
+        elapsed["tokenization"] += time.perf_counter() - start
+
+        results = {}
+
+        for name, fn in [("reference", align_labels_reference), ("vectorized", align_labels_with_tokens)]:
+            start = time.perf_counter()
+            results[name] = fn(tokenizer, features, [x["labels"] for x in batch])
+            elapsed[name] += time.perf_counter() - start
+
+        identical = identical and results["reference"] == results["vectorized"]
+
+    for name, seconds in elapsed.items():
+        logger.info(f"{name}: {seconds:.2f} s ({1e3 * seconds / len(examples):.2f} ms/example)")
+
+    logger.info(f"Preprocessing speedup: {(elapsed['tokenization'] + elapsed['reference']) / (elapsed['tokenization'] + elapsed['vectorized']):.2f}x")
+    logger.info(f"Identical labels: {identical}")
+
+    if not identical:
+        sys.exit("The vectorized label alignment differs from the original implementation")
+
+
+def _ddp_worker(rank, world_size, args, results):
+    """
+    A training process for `bench_ddp`: runs the training steps on synthetic batches with a fixed batch size per process
+    """
+    import os
+    import torch
+    from torch.nn.parallel import DistributedDataParallel
+    from transformers import AutoModelForTokenClassification
+    from utils.utils import Label
+    from utils.distributed import pin_threads
+
+    os.environ["MASTER_ADDR"] = "127.0.0.1"
+    os.environ["MASTER_PORT"] = str(args.port)
+    torch.distributed.init_process_group("gloo", rank=rank, world_size=world_size)
+    pin_threads(rank, world_size, args.max_threads)
+
+    torch.manual_seed(rank)
+    model = DistributedDataParallel(AutoModelForTokenClassification.from_pretrained(args.model_name, num_labels=len(Label)))
+    optimizer = torch.optim.AdamW(model.parameters(), lr=5e-5)
+    batch = {
+        "input_ids" : torch.randint(5, 1000, (args.batch_size, args.seq_length)),
+        "attention_mask" : torch.ones(args.batch_size, args.seq_length, dtype=torch.long),
+        "labels" : torch.randint(0, len(Label), (args.batch_size, args.seq_length))
+    }
+
+    for step in range(args.warmup_steps + args.steps):
+        if step == args.warmup_steps:
+            torch.distributed.barrier()
+            start = time.perf_counter()
+
+        loss = model(**batch)["loss"]
+        loss.backward()
+        optimizer.step()
+        optimizer.zero_grad()
+
+    torch.distributed.barrier()
+
+    if rank == 0:
+        results.put(time.perf_counter() - start)
+
+    torch.distributed.destroy_process_group()
+
+
+def bench_ddp(args):
+    """
+    CPU data-parallel training: throughput in examples per second for a number of local processes (gloo backend)
+    """
+    import torch.multiprocessing as mp
+
+    ctx = mp.get_context("spawn")
+    throughput = {}
+
+    for n_processes in args.processes:
+        results = ctx.SimpleQueue()
+        mp.spawn(_ddp_worker, args=(n_processes, args, results), nprocs=n_processes, join=True)
+        elapsed = results.get()
+
+        throughput[n_processes] = args.steps * args.batch_size * n_processes / elapsed
+        logger.info(f"{n_processes} processes: {throughput[n_processes]:.2f} examples/s "
+                    f"(speedup {throughput[n_processes] / throughput[args.processes[0]]:.2f}x)")
+
+
+def evaluate_submission(gsml, submitted, token_lookup):
+    """
+    Runs evaluate.py and returns the metrics for all the categories combined
+    """
+    import subprocess
+    import sys
+
+    out = subprocess.run([sys.executable, "evaluate.py", "--gsml", gsml, "--submitted", submitted, "--token_lookup", token_lookup],
+                         check=True, capture_output=True, text=True).stdout
+    metrics = {}
+
+    for line in out.splitlines():
+        metric, *values = line.split(",")
+
+        if metric in ["recall", "precision", "token_recall", "token_precision"]:
+            metrics[metric] = float(values[0])
+
+    return metrics
+
+
+def bench_distill(args):
+    """
+    Distilled student vs. teacher: GSML precision and recall (evaluate.py) and the decoding latency
+    """
+    import json
+    import statistics
+    from argparse import Namespace
+    from decode import Decoder
+
+    report = {}
+
+    for role, experiment in [("teacher", args.teacher), ("student", args.student)]:
+        decode_args = Namespace(exp_dir=args.exp_dir, experiment=experiment, checkpoint="model.ckpt", input_file=args.games,
+                                out_fname=args.out_fname, ctx=args.ctx, beam_size=1, gpus=args.gpus, max_length=512,
+                                templates=args.templates, rotowire_dir=args.rotowire_dir, embedding_store=None,
+                                retriever="dense", embedding_precision="fp32")
+        decoder = Decoder(decode_args)
+        n_params = sum(p.numel() for p in decoder.ec.model.model.parameters())
+
+        start = time.perf_counter()
+        output_path = decoder.decode()
+        elapsed = time.perf_counter() - start
+
+        report[role] = {
+            "experiment" : experiment,
+            "parameters" : n_params,
+            "latency_ms_mean" : 1e3 * statistics.mean(decoder.latencies),
+            "latency_ms_median" : 1e3 * statistics.median(decoder.latencies),
+            "decoding_time_s" : elapsed,
+            **evaluate_submission(args.gsml, output_path, args.token_lookup)
+        }
+
+    report["speedup"] = report["teacher"]["latency_ms_mean"] / report["student"]["latency_ms_mean"]
+
+    for key in ["parameters", "latency_ms_mean", "latency_ms_median", "decoding_time_s", "recall", "precision", "token_recall", "token_precision"]:
+        logger.info(f"{key:>20}: teacher {report['teacher'][key]:>12.3f} | student {report['student'][key]:>12.3f}")
+
+    logger.info(f"Student speedup: {report['speedup']:.2f}x")
+
+    with open(args.report, "w") as f:
+        json.dump(report, f, indent=4)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--games", default="games.csv", type=str,
+        help="File with the games for the task.")
+    parser.add_argument("--templates", type=str, default="compact",
+        help="Type of templates (simple / compact).")
+    parser.add_argument("--rotowire_dir", type=str, default="rotowire",
+        help="Path to the original Rotowire dataset.")
+    parser.add_argument("--n_games", type=int, default=1,
+        help="Number of games used for the benchmark.")
+    parser.add_argument("--ctx", type=int, default=40,
+        help="Number of sentences retrieved for the context.")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    parser_scorer = subparsers.add_parser("scorer", help=bench_scorer.__doc__.strip())
+    parser_scorer.add_argument("--cache_size", type=int, default=128,
+        help="Number of games kept in the embedding cache.")
+    parser_scorer.set_defaults(func=bench_scorer)
+
+    parser_retriever = subparsers.add_parser("retriever", help=bench_retriever.__doc__.strip())
+    parser_retriever.set_defaults(func=bench_retriever)
+
+    parser_precision = subparsers.add_parser("precision", help=bench_precision.__doc__.strip())
+    parser_precision.set_defaults(func=bench_precision)
+
+    parser_ner = subparsers.add_parser("ner", help=bench_ner.__doc__.strip())
+    parser_ner.add_argument("--split", type=str, default="train",
+        help="Rotowire split: train / dev / test.")
+    parser_ner.set_defaults(func=bench_ner)
+
+    parser_startup = subparsers.add_parser("startup", help=bench_startup.__doc__.strip())
+    parser_startup.add_argument("--split", type=str, default="train",
+        help="Rotowire split: train / dev / test.")
+    parser_startup.add_argument("--n_synthetic_games", type=int, default=3398,
+        help="Number of games in the synthetic split used if the Rotowire split is not available.")
+    parser_startup.set_defaults(func=bench_startup)
+
+    parser_numbers = subparsers.add_parser("numbers", help=bench_numbers.__doc__.strip())
+    parser_numbers.add_argument("--n_calls", type=int, default=100000,
+        help="Number of modified numbers.")
+    parser_numbers.add_argument("--seed", type=int, default=42,
+        help="Random seed.")
+    parser_numbers.set_defaults(func=bench_numbers)
+
+    parser_json = subparsers.add_parser("json", help=bench_json.__doc__.strip())
+    parser_json.add_argument("--dataset", type=str, default=None,
+        help="JSON dataset used for the benchmark (a synthetic dataset is used by default).")
+    parser_json.add_argument("--n_examples", type=int, default=50000,
+        help="Number of examples in the synthetic dataset.")
+    parser_json.set_defaults(func=bench_json)
+
+    parser_align = subparsers.add_parser("align", help=bench_align.__doc__.strip())
+    parser_align.add_argument("--dataset", type=str, required=True,
+        help="JSON or JSONL file with the examples, e.g. data/syn_compact_r0.25_ctx40/train.json.")
+    parser_align.add_argument("--n_examples", type=int, default=5000,
+        help="Number of examples used for the benchmark.")
+    parser_align.add_argument("--model_name", type=str, default="roberta-base",
+        help="Name of the model from the Huggingface Transformers library.")
+    parser_align.add_argument("--max_length", type=int, default=512,
+        help="Maximum number of tokens per example")
+    parser_align.add_argument("--batch_size", type=int, default=1000,
+        help="Number of examples tokenized at once.")
+    parser_align.set_defaults(func=bench_align)
+
+    parser_ddp = subparsers.add_parser("ddp", help=bench_ddp.__doc__.strip())
+    parser_ddp.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4, 8],
+        help="Numbers of local training processes.")
+    parser_ddp.add_argument("--max_threads", type=int, default=8,
+        help="Maximum number of CPU threads, divided among the processes.")
+    parser_ddp.add_argument("--model_name", type=str, default="roberta-base",
+        help="Name of the model from the Huggingface Transformers library.")
+    parser_ddp.add_argument("--batch_size", type=int, default=4,
+        help="Batch size per process.")
+    parser_ddp.add_argument("--seq_length", type=int, default=256,
+        help="Number of tokens per example.")
+    parser_ddp.add_argument("--steps", type=int, default=10,
+        help="Number of measured training steps.")
+    parser_ddp.add_argument("--warmup_steps", type=int, default=2,
+        help="Number of training steps before the measurement.")
+    parser_ddp.add_argument("--port", type=int, default=29500,
+        help="Port for the process group.")
+    parser_ddp.set_defaults(func=bench_ddp)
+
+    parser_distill = subparsers.add_parser("distill", help=bench_distill.__doc__.strip())
+    parser_distill.add_argument("--teacher", type=str, required=True,
+        help="Experiment with the teacher model.")
+    parser_distill.add_argument("--student", type=str, required=True,
+        help="Experiment with the distilled student model.")
+    parser_distill.add_argument("--exp_dir", default="experiments", type=str,
+        help="Base directory of the experiments.")
+    parser_distill.add_argument("--out_fname", default="out.csv", type=str,
+        help="Name of the decoded file in the experiment directories.")
+    parser_distill.add_argument("--gsml", type=str, default="gsml.csv",
+        help="The GSML file with the annotated errors.")
+    parser_distill.add_argument("--token_lookup", type=str, default="token_lookup.yaml",
+        help="The tokenization file for evaluate.py.")
+    parser_distill.add_argument("--gpus", default=0, type=int,
+        help="Number of GPUs used for decoding.")
+    parser_distill.add_argument("--report", type=str, default="distillation_report.json",
+        help="Output file with the report.")
+    parser_distill.set_defaults(func=bench_distill)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -8,6 +8,7 @@ import re
 import torch
 import json
 import csv
+import time
 import pytorch_lightning as pl
 
 from pprint import pprint as pp
@@ -15,7 +16,7 @@ from model import ErrorCheckerInferenceModule
 from nltk import sent_tokenize
 from utils.utils import Label
 from utils import tokenizer
-from utils.sentence_scorer import SentenceScorer
+from utils.sentence_scorer import get_scorer
 
 from preprocess import load_games
 from generate import Generator
@@ -32,7 +33,7 @@ class Decoder:
         ec_model_path = os.path.join(args.exp_dir, args.experiment, args.checkpoint)
 
         self.ec = ErrorCheckerInferenceModule(args, model_path=ec_model_path)
-        self.ss = SentenceScorer()
+        self.ss = get_scorer(self.args.retriever, precision=self.args.embedding_precision)
 
 
     def process_input_file(self, row, test_games, f_out):
@@ -49,10 +50,14 @@ class Decoder:
         sentences = sent_tokenize(text)
         doc_token_idx = 0
 
-        for sent_idx, sentence in enumerate(sentences):
-            text = self.ss.retrieve_ctx(sentence=sentence, game_data=game_data, cnt=self.args.ctx)
+        ctx_scored_batch = self.ss.retrieve_ctx_scored_batch(sentences=sentences, game_data=game_data, cnt=self.args.ctx)
+
+        for sent_idx, (sentence, ctx_scored) in enumerate(zip(sentences, ctx_scored_batch)):
+            text = " ".join([x[0] for x in ctx_scored])
             hyp = sentence
+            start = time.perf_counter()
             out = self.ec.predict(text=text, hyp=hyp, beam_size=self.args.beam_size, is_hyp_tokenized=True)
+            self.latencies.append(time.perf_counter() - start)
 
             for token_idx, (token, tag) in enumerate(out):
                 doc_token_idx += 1
@@ -87,12 +92,17 @@ class Decoder:
         Produces error annotations for the games.csv file
         """
         self.error_id = 0
-        templates_path = f"./context/{args.templates}"
+        self.latencies = []     # time of the model prediction for each sentence
+        templates_path = f"./context/{self.args.templates}"
 
         test_games = load_games(templates_path, rotowire_dir=self.args.rotowire_dir, split="test")
-        output_path = os.path.join(args.exp_dir, args.experiment, args.out_fname)
+
+        if self.args.embedding_store:
+            self.ss.load_store(self.args.embedding_store, templates_path, "test", test_games)
+
+        output_path = os.path.join(self.args.exp_dir, self.args.experiment, self.args.out_fname)
         
-        with open(args.input_file) as f_in, open(output_path, "w") as f_out:
+        with open(self.args.input_file) as f_in, open(output_path, "w") as f_out:
             reader = csv.reader(f_in, delimiter=',', quotechar='"')
             # skip header of games.csv
             next(reader)
@@ -106,6 +116,12 @@ class Decoder:
                 # each game is in a separate file
                 self.process_input_file(row, test_games, f_out)
 
+        if self.latencies:
+            logger.info(f"Model latency: {1e3 * sum(self.latencies) / len(self.latencies):.1f} ms per sentence "
+                        f"({len(self.latencies)} sentences)")
+
+        return output_path
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -135,6 +151,12 @@ if __name__ == "__main__":
         help="Type of templates (simple / compact).")
     parser.add_argument("--rotowire_dir", type=str, default="rotowire",
         help="Path to the original Rotowire dataset.")
+    parser.add_argument("--embedding_store", type=str, default=None,
+        help="Directory with the persistent store of template embeddings (built on first use).")
+    parser.add_argument("--retriever", type=str, default="dense", choices=["dense", "bm25", "hybrid"],
+        help="Method for retrieving the context: dense (sentence embeddings), bm25 (sparse), or hybrid.")
+    parser.add_argument("--embedding_precision", type=str, default="fp32", choices=["fp32", "fp16", "int8"],
+        help="Precision of the template embeddings kept in memory.")
     args = parser.parse_args()
 
     logger.info(args)
@@ -3,27 +3,29 @@
 import os
 import argparse
 import logging
-import json
 import random
-import re
 import torch
 import spacy, en_core_web_sm
 import csv
+import multiprocessing
 
-from utils.json_encoder import CompactJSONEncoder
+from utils.dataset_writer import DatasetWriter
+from utils.checkpoint import GenerationCheckpoint, args_hash
+from utils.folds import write_fold_manifest
 from utils.utils import Label
 from utils.tokenizer import Tokenizer as Detokenizer
 from utils.tokenizer import normalize_tokens
-from utils.sentence_scorer import SentenceScorer
-from utils.utils import random_choice_neq
+from utils.sentence_scorer import get_scorer
+from utils.ner_cache import NERCache, annotate_doc
+from utils.utils import SubstitutionTable
+from utils.number_perturbation import modify_numbers, SCORE_RE
 
 from nltk import word_tokenize, sent_tokenize
-from num2words import num2words
-from text_to_num import alpha2digit
 
 from transformers import AutoTokenizer
 from collections import defaultdict
 from preprocess import load_games
+from utils.rotowire import Rotowire
 from pprint import pprint as pp
 
 logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO, datefmt='%H:%M:%S')
@@ -31,75 +33,115 @@ logger = logging.getLogger(__name__)
 
 
 class Generator:
+    NER_BATCH_GAMES = 32    # number of games processed at once by the Spacy NLP pipeline
+    # arguments which do not influence the generated examples
+    CHECKPOINT_IGNORED_ARGS = ["workers", "checkpoint_dir", "embedding_store", "ner_cache", "output_format",
+                               "tokenized_model", "max_length"]
+
     def __init__(self, args):
         self.args = args
         self.tokenizer = AutoTokenizer.from_pretrained('roberta-base', use_fast=True, add_prefix_space=True)
         self.detokenizer = Detokenizer()
-        self.spacy_nlp = en_core_web_sm.load()
-        self.cities = self.load_cities()
-        self.days_of_week = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+        # only the named entities are used, the NER component in en_core_web_sm has its own tok2vec layer
+        self.spacy_nlp = en_core_web_sm.load(disable=["tok2vec", "tagger", "parser", "attribute_ruler", "lemmatizer"])
+        self.cities = SubstitutionTable(self.load_cities(), tokenize=word_tokenize)
+        self.days_of_week = SubstitutionTable(["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"])
         self.ents_total_cnt = 0         # stats of modified entities
         self.ents_total_mod_cnt = 0
-        self.rotowire = defaultdict(None)
-        self.ss = SentenceScorer()
+        self.modification_rate = self.args.modification_rate[0]     # rate for the configuration being generated
+        self.rotowire = {}      # Rotowire splits, loaded lazily
+        self.ss = get_scorer(self.args.retriever, precision=self.args.embedding_precision)
+        self.ner_cache = NERCache(self.args.ner_cache, self.spacy_nlp) if self.args.ner_cache else None
+        self.model_tokenizer = None     # tokenizer for the pre-tokenized datasets, loaded lazily
 
-        for split in ["test", "dev", "train"]:
-            with open(os.path.join(self.args.rotowire_dir, f"{split}.json")) as f:
-                self.rotowire[split] = json.load(f)
 
+    def get_rotowire(self, split):
+        if split not in self.rotowire:
+            self.rotowire[split] = Rotowire(self.args.rotowire_dir, split)
 
-    def load_cities(self):
+        return self.rotowire[split]
+
+
+    def load_games(self, split, templates):
         """
-        Load the list of team cities extracted from the Rotowire dataset.
-        The cities are used for adding noise to the texts. 
+        Load the sentences generated for the games and the respective embedding store (if used)
         """
-        cities = []
-        with open("cities.txt") as f:
-            for line in f.readlines():
-                cities.append(line.rstrip("\n"))
-        return cities
+        templates_path = f"./context/{templates}"
+        games = load_games(templates_path, rotowire_dir=self.args.rotowire_dir, split=split, rotowire=self.get_rotowire(split))
 
+        if self.args.embedding_store:
+            self.ss.load_store(self.args.embedding_store, templates_path, split, games)
 
-    def modify_numbers(self, orig_text, mode="cardinal"):
+        return games
+
+
+    def load_all_games(self, split):
+        """
+        Load the games for all the template types, returns a dictionary templates -> games
         """
-        Modify numbers (integers) based on the mode (cardinal / ordinal). Gaussian noise with a cut-off at
-        zero is applied until the number is different from the original number.
+        return {templates : self.load_games(split, templates) for templates in self.args.templates}
+
+
+    def get_configs(self):
+        """
+        Returns the list of the generated configurations (templates, modification_rate)
+        """
+        return [(templates, rate) for templates in self.args.templates for rate in self.args.modification_rate]
+
+
+    def get_output_dir(self, ctx_size, templates, modification_rate):
+        """
+        Returns the output directory for the configuration. If multiple configurations are generated at once,
+        the output name has to contain the placeholders {templates} and/or {modification_rate}.
+        """
+        output = self.args.output.format(templates=templates, modification_rate=modification_rate)
+
+        if self.args.shared_ctx:
+            # a single dataset with up to `ctx_size` ranked context sentences
+            return os.path.join(self.args.data_dir, output + f"_ranked{ctx_size}")
+
+        return os.path.join(self.args.data_dir, output + f"_ctx{ctx_size}")
+
 
-        If `orig_text` contains non-digit numbers, alpha2digit is used to transform all the numbers 
-        in text to digit-only variants and transformed back to text after modifications.
+    def get_writer(self, path):
         """
-        orig_text = str(orig_text)
-        text = alpha2digit(orig_text, "en")
+        Returns a writer for the output file `path` (without the extension), which also writes
+        a pre-tokenized dataset if `--tokenized_model` is used
+        """
+        if self.args.tokenized_model and self.model_tokenizer is None:
+            self.model_tokenizer = AutoTokenizer.from_pretrained(self.args.tokenized_model, use_fast=True, add_prefix_space=True)
 
-        if mode == "ordinal":
-            # alpha2digit cannot handle "first", "second" and "third", has to be handled separately
-            extra_ordinals = {"first" : "1st", "second" : "2nd", "third" : "3rd"}
-            for k, v in extra_ordinals.items():
-                # replace only if surrounded by word breaks to avoid things like seconds -> 2nds
-                text = re.sub(rf"\b{k}\b", rf"{v}", text)
+        return DatasetWriter(path, fmt=self.args.output_format, tokenizer=self.model_tokenizer, max_length=self.args.max_length)
 
-        to_lex = (orig_text != text)    # some numbers in lexical form were transformed to digits
-        chars = [ch for ch in text]
 
-        # find all number-like groups
-        numbers = [(m.group(0), m.start(0), m.end(0)) for m in re.finditer(r"\d+\w*", text)]
+    def ctx_fields(self, ctx_sents):
+        """
+        Returns the context fields of an example: either the ranked context sentences (with `--shared_ctx`),
+        or the context tokens (`ctx_sents` then contains a single item with the whole context)
+        """
+        if self.args.shared_ctx:
+            return {"ctx_sents" : ctx_sents}
 
-        for num_str, start, end in numbers:
-            # extract digits for modifications
-            num = int(re.search(r"\d+", num_str).group(0))
-            modified_num = num
+        return {"ctx" : ctx_sents[0]}
 
-            # apply Gaussian noise with sigma=3 until the number differs
-            # negative numbers do not occur in texts -> threshold at zero
-            while modified_num == num:
-                modified_num = max(0, int(random.gauss(num, 3)))
 
-            if to_lex:
-                modified_num = num2words(modified_num, to=mode)
+    def load_cities(self):
+        """
+        Load the list of team cities extracted from the Rotowire dataset.
+        The cities are used for adding noise to the texts. 
+        """
+        cities = []
+        with open("cities.txt") as f:
+            for line in f.readlines():
+                cities.append(line.rstrip("\n"))
+        return cities
 
-            chars[start:end] = [ch for ch in str(modified_num)]
 
-        return "".join(chars)
+    def modify_numbers(self, orig_text, mode="cardinal"):
+        """
+        Modify numbers (integers) based on the mode (cardinal / ordinal), see `utils.number_perturbation`.
+        """
+        return modify_numbers(orig_text, mode=mode)
 
 
     def modify_text_with_numbers(self, ent_tokens, mode):
@@ -111,7 +153,7 @@ class Generator:
             token = str(token)
 
             # this enables to modify some of the numbers in cases such as if "14-11" is identified as a single entity
-            if i > 0 and random.random() > self.args.modification_rate:
+            if i > 0 and random.random() > self.modification_rate:
                 modified_token = token
             else:    
                 modified_token = self.modify_numbers(token, mode=mode)
@@ -126,11 +168,10 @@ class Generator:
         return tokens, labels
 
 
-    def modify_entity(self, doc, game_data, entity):
+    def modify_entity(self, game_data, entity):
         """
         Make the entity errorneous.
 
-        doc - output of Spacy NER NLP pipeline
         game_data - GameData object for the game
         entity - (text, label, start, end, list_of_tokens) as identified Spacy NER
         """
@@ -140,25 +181,25 @@ class Generator:
 
         if ent_text in self.days_of_week:
             # change a day of week to a random day
-            random_day = random_choice_neq(l=self.days_of_week, neq_to=ent_text)
-            tokens = [random_day]
+            _, random_day_tokens = self.days_of_week.sample_neq(ent_text)
+            tokens = list(random_day_tokens)
             labels = [Label.NAME]
         elif ent_type == "PERSON":
             # swap a player with another player present in the game
-            random_player = random_choice_neq(l=list(game_data.get_players()), neq_to=ent_text)
-            tokens = word_tokenize(random_player)
+            _, random_player_tokens = game_data.get_players().sample_neq(ent_text)
+            tokens = list(random_player_tokens)
             labels = [Label.NAME for token in tokens]
         elif ent_type == "GPE":
             # GPE - usually a name of the city; select another city from all the cities
             # in the Rotowire dataset
-            random_city = random_choice_neq(l=self.cities, neq_to=ent_text)
-            tokens = word_tokenize(random_city)
+            _, random_city_tokens = self.cities.sample_neq(ent_text)
+            tokens = list(random_city_tokens)
             labels = [Label.NAME for token in tokens]
         elif ent_type == "CARDINAL" \
                 or ent_type == "PERCENT" \
                 or ent_type == "TIME" \
                 or ent_type == "QUANTITY" \
-                or re.match(r"\d+\s*-\s*\d+", ent_text):
+                or SCORE_RE.match(ent_text):
             tokens, labels = self.modify_text_with_numbers(ent_tokens, mode="cardinal")
         elif ent_type == "ORDINAL" \
             or "half" in ent_text \
@@ -166,8 +207,8 @@ class Generator:
             tokens, labels = self.modify_text_with_numbers(ent_tokens, mode="ordinal")
         elif ent_text in game_data.get_teams():
             # change to the other team name
-            random_team = random_choice_neq(l=list(game_data.get_teams()), neq_to=ent_text)
-            tokens = word_tokenize(random_team)
+            _, random_team_tokens = game_data.get_teams().sample_neq(ent_text)
+            tokens = list(random_team_tokens)
             labels = [Label.NAME for token in tokens]
         elif ent_type in ["NORP", "PRODUCT", "EVENT", "DATE", "LOC", "ORG", "FAC"]:
             # logger.warning(f"Skipping {ent_type}: {ent_text}")
@@ -186,12 +227,16 @@ class Generator:
         return tokens, labels
 
 
-    def augment(self, doc, game_data):
-        ne = [(ent.text, 
-               ent.label_, 
-               ent.start, 
-               ent.end, 
-               [doc[i] for i in range(ent.start, ent.end)]) for ent in doc.ents]
+    def augment(self, annotation, game_data):
+        """
+        Modify the named entities in the sentence annotated by `annotate_doc`
+        """
+        sent_tokens = annotation["tokens"]
+        ne = [(text, 
+               label, 
+               start, 
+               end, 
+               sent_tokens[start:end]) for text, label, start, end in annotation["ents"]]
         starts = [x[2] for x in ne]
         ends = [x[3] for x in ne]
         tokens = []
@@ -201,8 +246,8 @@ class Generator:
 
         self.ents_total_cnt += len(ne)
 
-        for i, token in enumerate(doc):
-            if i in starts and random.random() < self.args.modification_rate:
+        for i, token in enumerate(sent_tokens):
+            if i in starts and random.random() < self.modification_rate:
                 # modify only a portion of named entities defined by the modification_rate argument
                 current_entity = ne[starts.index(i)]
                 current_entity_started = True
@@ -214,7 +259,7 @@ class Generator:
             elif current_entity_started:
                 # modified entity may have a different number of tokens
                 # -> new tokens are added, remaining original tokens are skipped
-                ent_tokens, ent_labels = self.modify_entity(doc, game_data, current_entity)
+                ent_tokens, ent_labels = self.modify_entity(game_data, current_entity)
                 tokens += ent_tokens
                 labels += ent_labels
                 self.ents_total_mod_cnt += 1
@@ -224,97 +269,207 @@ class Generator:
 
         return (tokens, labels)
 
-    def generate(self, games, split, ctx_sizes):
-        data = {ctx_size : [] for ctx_size in ctx_sizes}
-
-        start = self.args.start or 0
-        end = self.args.end or len(games)
+    def annotate_summaries(self, split, game_ids):
+        """
+        Split the Rotowire summaries for the games into sentences and identify the named entities
+        using the Spacy NLP pipeline. All the sentences are processed in batches using `nlp.pipe`.
+        If the NER cache is used, only the games which are not cached yet are processed.
 
-        for game_id in range(start, end):
-            if game_id >= len(games):
-                break
+        Returns a dictionary game_id -> list of sentence annotations (see `annotate_doc`)
+        """
+        annotations = {}
+        sents = {}
 
-            game_data = games[game_id]
+        for game_id in game_ids:
+            cached = self.ner_cache.get(split, game_id) if self.ner_cache else None
 
-            if not game_data:
+            if cached is not None:
+                annotations[game_id] = cached
                 continue
 
-            rotowire_game = self.rotowire[split][game_id]
-            rotowire_summary = rotowire_game["summary"]
+            rotowire_summary = self.get_rotowire(split).get_summary(game_id)
             rotowire_summary_sents = sent_tokenize(" ".join(rotowire_summary))
+            sents[game_id] = [self.detokenizer.detokenize(sent) for sent in rotowire_summary_sents]
 
-            for sent in rotowire_summary_sents:
-                sent_detok = self.detokenizer.detokenize(sent)
+        docs = self.spacy_nlp.pipe([sent for game_id in sents for sent in sents[game_id]], batch_size=256)
 
-                # run the Spacy NLP pipeline for identifying named entities
-                doc = self.spacy_nlp(sent_detok)
-                modif_tokens, modif_labels = self.augment(doc, game_data)
-                modif_sent_detok = self.detokenizer.detokenize(" ".join(modif_tokens))
+        for game_id in sents:
+            annotations[game_id] = [annotate_doc(next(docs)) for _ in sents[game_id]]
 
-                # retrieve N scored sentences where N is the largest context size
-                ctx_scored = self.ss.retrieve_ctx_scored(modif_sent_detok, game_data, cnt=sorted(ctx_sizes)[-1])
+            if self.ner_cache:
+                self.ner_cache.put(split, game_id, annotations[game_id])
 
-                for ctx_size in ctx_sizes:
-                    ctx = " ".join([x[0] for x in ctx_scored[:ctx_size]])
-                    ctx_tokens = word_tokenize(ctx)
+        return annotations
 
-                    # there is not "%" sign in the task data
-                    # "\" may break the resulting JSON
-                    ctx_tokens = [str(token).replace("%", "percent").replace("\\","") for token in ctx_tokens]
-                    modif_tokens = [str(token).replace("%", "percent").replace("\\","") for token in modif_tokens]
+    def generate_game(self, game_data, split, game_id, ctx_sizes, annotations):
+        """
+        Generate the examples for a single game from the annotations of the sentences in the Rotowire summary.
+        The random generator is seeded with the game id, so that the output does not depend on the order
+        in which the games are processed.
+        """
+        data = {ctx_size : [] for ctx_size in ctx_sizes}
+        random.seed(f"{self.args.seed}-{split}-{game_id}")
 
-                    assert len(modif_tokens) == len(modif_labels)
+        modif_sents = []
 
-                    example = {
-                        "ctx" : ctx_tokens,
-                        "sent" : modif_tokens,
-                        "labels": modif_labels
-                    }
-                    data[ctx_size].append(example)
+        for annotation in annotations:
+            modif_tokens, modif_labels = self.augment(annotation, game_data)
+            modif_sent_detok = self.detokenizer.detokenize(" ".join(modif_tokens))
+            modif_sents.append((modif_tokens, modif_labels, modif_sent_detok))
 
-                if len(data) > 0 and len(data[ctx_sizes[0]]) % 20 == 0:
-                    logger.info(f"{len(data)} examples generated (game id {game_id}).")
+        # retrieve N scored sentences for all the sentences in the summary where N is the largest context size
+        ctx_scored_batch = self.ss.retrieve_ctx_scored_batch([x[2] for x in modif_sents], game_data, cnt=sorted(ctx_sizes)[-1])
 
-        out_fname = f"{split}.json"
-        logger.info(f"{self.ents_total_mod_cnt}/{self.ents_total_cnt} entities modified.")
+        for (modif_tokens, modif_labels, _), ctx_scored in zip(modif_sents, ctx_scored_batch):
+            for ctx_size in ctx_sizes:
+                if self.args.shared_ctx:
+                    ctx_sents = [word_tokenize(x[0]) for x in ctx_scored[:ctx_size]]
+                else:
+                    ctx_sents = [word_tokenize(" ".join([x[0] for x in ctx_scored[:ctx_size]]))]
+
+                # there is not "%" sign in the task data
+                # "\" may break the resulting JSON
+                ctx_sents = [[str(token).replace("%", "percent").replace("\\","") for token in ctx_tokens] for ctx_tokens in ctx_sents]
+                modif_tokens = [str(token).replace("%", "percent").replace("\\","") for token in modif_tokens]
+
+                assert len(modif_tokens) == len(modif_labels)
+
+                example = {
+                    **self.ctx_fields(ctx_sents),
+                    "sent" : modif_tokens,
+                    "labels": modif_labels
+                }
+                data[ctx_size].append(example)
+
+        return data
+
+    def generate_games(self, games, split, game_ids, ctx_sizes):
+        """
+        Generate the examples for a chunk of games for all the configurations. The NER is shared
+        by all the configurations.
+
+        Returns a list of tuples (game_id, examples, ents_cnt, ents_mod_cnt) for each game, where examples[i][j]
+        is the list of examples for the i-th configuration and the j-th context size, and ents_cnt and ents_mod_cnt
+        are the counts of all and modified entities.
+        """
+        annotations = self.annotate_summaries(split, game_ids)
+        results = []
+
+        for game_id in game_ids:
+            ents_cnt, ents_mod_cnt = self.ents_total_cnt, self.ents_total_mod_cnt
+            examples = []
+
+            for templates, modification_rate in self.get_configs():
+                game_data = games[templates][game_id]
+
+                if not game_data:
+                    examples.append([[] for _ in ctx_sizes])
+                    continue
+
+                self.modification_rate = modification_rate
+                game_examples = self.generate_game(game_data, split, game_id, ctx_sizes, annotations[game_id])
+                examples.append([game_examples[ctx_size] for ctx_size in ctx_sizes])
+
+            results.append((game_id, examples, self.ents_total_cnt - ents_cnt, self.ents_total_mod_cnt - ents_mod_cnt))
+
+        return results
+
+    def generate(self, games, split, ctx_sizes):
+        """
+        Generate the examples for all the configurations, `games` is a dictionary templates -> games.
+
+        If a checkpoint directory is used, each completed game is committed to the checkpoint
+        and the games completed in a previous run with the same arguments are not generated again.
+        The checkpoint is removed after all the output files are written.
+        """
+        configs = self.get_configs()
+        n_games = min(len(templates_games) for templates_games in games.values())
+        start = self.args.start or 0
+        end = min(self.args.end or n_games, n_games)
+        game_ids = [game_id for game_id in range(start, end) if any(games[templates][game_id] for templates in games)]
+
+        checkpoint = None
+        completed = {}
+
+        if self.args.checkpoint_dir:
+            run_id = args_hash(self.args, ignore=self.CHECKPOINT_IGNORED_ARGS)
+            checkpoint = GenerationCheckpoint(os.path.join(self.args.checkpoint_dir, f"{split}-{run_id}"))
+            completed = checkpoint.load()
+
+        # the games are processed in chunks, NER is run for all the sentences in a chunk at once
+        todo_ids = [game_id for game_id in game_ids if game_id not in completed]
+        chunk_size = max(1, min(self.NER_BATCH_GAMES, len(todo_ids) // self.args.workers))
+        chunks = [todo_ids[i:i+chunk_size] for i in range(0, len(todo_ids), chunk_size)]
+
+        out_fname = f"{split}"
 
         if self.args.start or self.args.end:
             # partial file for parallelization, will be merged
-            out_fname = f"{split}-{self.args.start:04d}-{self.args.end:04d}.json"
+            out_fname = f"{split}-{start:04d}-{self.args.end or end:04d}"
+
+        # the examples are written to the output files as soon as they are generated
+        writers = {
+            (config, ctx_size) : self.get_writer(os.path.join(self.get_output_dir(ctx_size, *config), out_fname))
+            for config in configs for ctx_size in ctx_sizes
+        }
+        examples_cnt = 0
+
+        if self.args.workers > 1:
+            # each worker process has its own instance of the generator, the results are collected in order
+            ctx = multiprocessing.get_context("spawn")
+            pool = ctx.Pool(self.args.workers, initializer=_init_worker, initargs=(self.args, split))
+            results = pool.imap(_generate_games_worker, [(split, chunk, ctx_sizes) for chunk in chunks])
+        else:
+            results = (self.generate_games(games, split, chunk, ctx_sizes) for chunk in chunks)
 
-        for ctx_size in ctx_sizes:
-            with open(os.path.join(self.args.data_dir, self.args.output + f"_ctx{ctx_size}", out_fname), "w") as f:
-                s = json.dumps({"data" : data[ctx_size]}, ensure_ascii=False, indent=4, cls=CompactJSONEncoder)
-                f.write(s)
+        results = (game_result for chunk_results in results for game_result in chunk_results)
 
-    def get_xval_splits(self, data, x):
-        xval_splits = {s : [] for s in ["train", "dev", "test"]}
+        try:
+            for game_id in game_ids:
+                if game_id in completed:
+                    examples = checkpoint.get(game_id)
+                    ents_cnt, ents_mod_cnt = completed[game_id]["ents_cnt"], completed[game_id]["ents_mod_cnt"]
+                else:
+                    result_game_id, examples, ents_cnt, ents_mod_cnt = next(results)
+                    assert result_game_id == game_id
 
-        test_size = len(data) // self.args.xval_splits
-        dev_size = (len(data) // self.args.xval_splits) // 2
-        train_size = len(data) - test_size - dev_size
+                    if checkpoint:
+                        checkpoint.commit(game_id, examples, sum(len(x[0]) for x in examples), ents_cnt, ents_mod_cnt)
 
-        test_range = range(x*test_size, x*test_size+test_size)
+                self.ents_total_cnt += ents_cnt
+                self.ents_total_mod_cnt += ents_mod_cnt
 
-        if x != self.args.xval_splits-1:
-            dev_range = range(x*test_size+test_size, x*test_size+test_size+dev_size)
-        else:
-            dev_range = range(0, dev_size)
+                for i, config in enumerate(configs):
+                    for j, ctx_size in enumerate(ctx_sizes):
+                        writers[(config, ctx_size)].write_all(examples[i][j])
 
-        # print("test: ", list(test_range))
-        # print("dev: ", list(dev_range))
+                examples_cnt += len(examples[0][0])
 
-        for i in range(len(data)):
-            if i in test_range:
-                xval_splits["test"].append(data[i])
-            elif i in dev_range:
-                xval_splits["dev"].append(data[i])
-            else:
-                xval_splits["train"].append(data[i])
+                if game_id not in completed:
+                    logger.info(f"{examples_cnt} examples generated (game id {game_id}).")
+        except BaseException:
+            # the output files would be incomplete
+            for writer in writers.values():
+                writer.abort()
+
+            if self.args.workers > 1:
+                pool.terminate()
+            raise
+
+        if self.args.workers > 1:
+            pool.close()
+            pool.join()
 
-        return xval_splits
+        for writer in writers.values():
+            writer.close()
 
-    def extract_annotated(self, games, ctx_sizes):
+        if checkpoint:
+            # all the output files are complete, the checkpoint is no longer needed
+            checkpoint.remove()
+
+        logger.info(f"{self.ents_total_mod_cnt}/{self.ents_total_cnt} entities modified.")
+
+    def extract_annotated(self, games, ctx_sizes, templates):
         """
         Generate training data from the annotated data for the task.
         """
@@ -367,13 +522,15 @@ class Generator:
                     ctx_scored = self.ss.retrieve_ctx_scored(sent_detok, game_data, cnt=sorted(ctx_sizes)[-1])
 
                     for ctx_size in ctx_sizes:
-                        ctx = " ".join([x[0] for x in ctx_scored[:ctx_size]])
-                        ctx_tokens = normalize_tokens(word_tokenize(ctx))
+                        if self.args.shared_ctx:
+                            ctx_sents = [normalize_tokens(word_tokenize(x[0])) for x in ctx_scored[:ctx_size]]
+                        else:
+                            ctx_sents = [normalize_tokens(word_tokenize(" ".join([x[0] for x in ctx_scored[:ctx_size]])))]
                             
                         assert len(sent_tokens) == len(sent_labels)
                         
                         example = {
-                            "ctx" : ctx_tokens,
+                            **self.ctx_fields(ctx_sents),
                             "sent" : sent_tokens,
                             "labels": sent_labels
                         }
@@ -385,15 +542,13 @@ class Generator:
 
         if self.args.xval_splits:
             for ctx_size in ctx_sizes:
-                for x in range(self.args.xval_splits):
-                    data_splits = self.get_xval_splits(data[ctx_size], x)
+                # the data is saved once, the folds are saved as the indices of the examples in the splits
+                output_dir = self.get_output_dir(ctx_size, templates, self.modification_rate)
 
-                    for split_name, data_split in data_splits.items(): 
-                        out_fname = f"{split_name}.json"
+                with self.get_writer(os.path.join(output_dir, "all")) as writer:
+                    writer.write_all(data[ctx_size])
 
-                        with open(os.path.join(self.args.data_dir, self.args.output + f"_ctx{ctx_size}", f"{x}", out_fname), "w") as f:
-                            s = json.dumps({"data" : data_split}, ensure_ascii=False, indent=4, cls=CompactJSONEncoder)
-                            f.write(s)
+                write_fold_manifest(os.path.join(output_dir, "folds.json"), len(data[ctx_size]), self.args.xval_splits)
         else:
             for ctx_size in ctx_sizes:
                 dev_size = int(len(data[ctx_size])/10)
@@ -401,13 +556,11 @@ class Generator:
                 dev_split = data[ctx_size][:dev_size]
                 train_split = data[ctx_size][dev_size:]
 
-                with open(os.path.join(self.args.data_dir, self.args.output + f"_ctx{ctx_size}", "train.json"), "w") as f:
-                    s = json.dumps({"data" : train_split}, ensure_ascii=False, indent=4, cls=CompactJSONEncoder)
-                    f.write(s)
+                with self.get_writer(os.path.join(self.get_output_dir(ctx_size, templates, self.modification_rate), "train")) as writer:
+                    writer.write_all(train_split)
 
-                with open(os.path.join(self.args.data_dir, self.args.output + f"_ctx{ctx_size}", "dev.json"), "w") as f:
-                    s = json.dumps({"data" : dev_split}, ensure_ascii=False, indent=4, cls=CompactJSONEncoder)
-                    f.write(s)
+                with self.get_writer(os.path.join(self.get_output_dir(ctx_size, templates, self.modification_rate), "dev")) as writer:
+                    writer.write_all(dev_split)
 
 
 
@@ -432,9 +585,9 @@ class Generator:
 
                 logger.info(f"Processing game {game_id}")
 
-                for j, sent in enumerate(sentences):
-                    sent_detok = self.detokenizer.detokenize(sent)
-                    doc = self.spacy_nlp(sent_detok)
+                docs = self.spacy_nlp.pipe([self.detokenizer.detokenize(sent) for sent in sentences])
+
+                for j, doc in enumerate(docs):
                     nes = [(ent.text, 
                            ent.label_, 
                            ent.start, 
@@ -465,20 +618,36 @@ class Generator:
         
 
 
+# generator instance and games for a worker process, see `Generator.generate`
+_worker = None
+
+def _init_worker(args, split):
+    global _worker
+    torch.set_num_threads(max(1, multiprocessing.cpu_count() // args.workers))
+    g = Generator(args)
+    _worker = (g, g.load_all_games(split))
+
+def _generate_games_worker(job):
+    split, game_ids, ctx_sizes = job
+    g, games = _worker
+
+    return g.generate_games(games, split, game_ids, ctx_sizes)
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
-    parser.add_argument("--templates", type=str, required=True,
-        help="Type of templates (simple / compact).")
+    parser.add_argument("--templates", type=str, nargs="+", required=True,
+        help="Type of templates (simple / compact). Multiple types can be generated at once.")
     parser.add_argument("--rotowire_dir", type=str, default="rotowire",
         help="Path to data.")
     parser.add_argument("--data_dir", type=str, default="data",
         help="Path to data.")
     parser.add_argument("--output", type=str, required=True,
-        help="Name of the output directory.")
+        help="Name of the output directory. When generating multiple configurations at once, "
+        "use the placeholders {templates} and {modification_rate}.")
     parser.add_argument("--ctx", type=int, default=None,
         help="Number of sentences retrieved for the context.")
-    parser.add_argument("--modification_rate", type=float, default=0.5,
-        help="Proportion of modified entities.")
+    parser.add_argument("--modification_rate", type=float, nargs="+", default=[0.5],
+        help="Proportion of modified entities. Multiple rates can be generated at once.")
     parser.add_argument("--seed", type=int, default=42,
         help="Random seed.")
     parser.add_argument("--start", type=int, default=None,
@@ -495,6 +664,28 @@ if __name__ == '__main__':
         help="Only compute statistics for entities.")
     parser.add_argument("--xval_splits", type=int, default=None,
         help="Number of splits for cross-validation.")
+    parser.add_argument("--output_format", type=str, default="json", choices=["json", "jsonl"],
+        help="Format of the output files: json (single JSON object) or jsonl (one example per line, written as generated).")
+    parser.add_argument("--ner_cache", type=str, default=None,
+        help="Directory with the persistent cache of NER annotations of the Rotowire summaries.")
+    parser.add_argument("--checkpoint_dir", type=str, default=None,
+        help="Directory for checkpointing the completed games. A rerun with the same arguments continues "
+        "with the first unfinished game.")
+    parser.add_argument("--workers", type=int, default=1,
+        help="Number of local worker processes for generating the data.")
+    parser.add_argument("--embedding_store", type=str, default=None,
+        help="Directory with the persistent store of template embeddings (built on first use).")
+    parser.add_argument("--retriever", type=str, default="dense", choices=["dense", "bm25", "hybrid"],
+        help="Method for retrieving the context: dense (sentence embeddings), bm25 (sparse), or hybrid.")
+    parser.add_argument("--embedding_precision", type=str, default="fp32", choices=["fp32", "fp16", "int8"],
+        help="Precision of the template embeddings kept in memory.")
+    parser.add_argument("--shared_ctx", action="store_true",
+        help="Save a single dataset with the ranked context sentences (up to the largest context size) instead of a dataset "
+        "for each context size. The context size is then selected for training with the parameter --ctx of train.py.")
+    parser.add_argument("--tokenized_model", type=str, default=None,
+        help="Also save the data as a pre-tokenized binary dataset for the tokenizer of this model (e.g. roberta-base).")
+    parser.add_argument("--max_length", type=int, default=512,
+        help="Maximum number of tokens per example in the pre-tokenized dataset.")
 
     args = parser.parse_args()
 
@@ -503,24 +694,39 @@ if __name__ == '__main__':
 
     ctx_sizes = [args.ctx] if args.ctx is not None else [5, 10, 20, 40]
 
-    for ctx_size in ctx_sizes:
-        if args.xval_splits:
-            for x in range(args.xval_splits):
-                os.makedirs(os.path.join(args.data_dir, args.output + f"_ctx{ctx_size}", f"{x}"), exist_ok=True)
-        else:
-            os.makedirs(os.path.join(args.data_dir, args.output + f"_ctx{ctx_size}"), exist_ok=True)
+    if args.shared_ctx:
+        # the smaller context sizes are selected when loading the data
+        ctx_sizes = [max(ctx_sizes)]
+
+    configs = [(templates, rate) for templates in args.templates for rate in args.modification_rate]
+
+    if len(set(args.output.format(templates=templates, modification_rate=rate) for templates, rate in configs)) != len(configs):
+        parser.error("Use the placeholders {templates} and {modification_rate} in --output for generating multiple configurations.")
+
+    if args.tokenized_model and (args.start is not None or args.end is not None):
+        # utils/merge_json.py merges only the data files
+        parser.error("--tokenized_model cannot be used with --start/--end, create the pre-tokenized dataset "
+            "after merging the partial files with `python -m utils.token_dataset`.")
+
+    if args.annotations is not None and len(args.modification_rate) > 1:
+        # the annotated errors are not modified, the rate does not apply
+        parser.error("Only a single --modification_rate can be used with --annotations.")
 
-    templates_path = f"./context/{args.templates}"
     g = Generator(args)
 
+    for config in g.get_configs():
+        for ctx_size in ctx_sizes:
+            os.makedirs(g.get_output_dir(ctx_size, *config), exist_ok=True)
+
     if args.get_stats_ents:
         g.get_stats_ents()
     else:
         if args.annotations is not None:
-            games = load_games(templates_path, rotowire_dir=args.rotowire_dir, split="test")
-            g.extract_annotated(games, ctx_sizes)
+            for templates in args.templates:
+                games = g.load_games(split="test", templates=templates)
+                g.extract_annotated(games, ctx_sizes, templates)
         else:
             logger.info(f"Processing {args.split} data")
             
-            games = load_games(templates_path, rotowire_dir=args.rotowire_dir, split=args.split)
+            games = g.load_all_games(split=args.split)
             g.generate(games, args.split, ctx_sizes)
@@ -15,7 +15,7 @@ import pytorch_lightning as pl
 from pprint import pprint as pp
 from model import ErrorCheckerInferenceModule
 from preprocess import load_games
-from utils.sentence_scorer import SentenceScorer
+from utils.sentence_scorer import get_scorer
 
 logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO, datefmt='%H:%M:%S')
 logger = logging.getLogger(__name__)
@@ -49,6 +49,12 @@ if __name__ == "__main__":
         help="Type of templates (simple / compact).")
     parser.add_argument("--is_tokenized", action="store_true",
         help="Input is tokenized, split on spaces.")
+    parser.add_argument("--embedding_store", type=str, default=None,
+        help="Directory with the persistent store of template embeddings (built on first use).")
+    parser.add_argument("--retriever", type=str, default="dense", choices=["dense", "bm25", "hybrid"],
+        help="Method for retrieving the context: dense (sentence embeddings), bm25 (sparse), or hybrid.")
+    parser.add_argument("--embedding_precision", type=str, default="fp32", choices=["fp32", "fp16", "int8"],
+        help="Precision of the template embeddings kept in memory.")
 
     args = parser.parse_args()
     logger.info(args)
@@ -68,8 +74,12 @@ if __name__ == "__main__":
         text = input("[Context]: ")
     else:
         # retrieve context automatically based on the game id
-        ss = SentenceScorer()
+        ss = get_scorer(args.retriever, precision=args.embedding_precision)
         test_games = load_games(templates_path, rotowire_dir=args.rotowire_dir, split="test")
+
+        if args.embedding_store:
+            ss.load_store(args.embedding_store, templates_path, "test", test_games)
+
         game_data = test_games[game_idx]
 
     while True:
@@ -14,13 +14,18 @@ import torch.nn.functional as F
 import random
 
 from nltk import word_tokenize
-from torch.utils.data import DataLoader, Dataset
+from torch.utils.data import DataLoader, Dataset, Subset
+from torch.utils.data.distributed import DistributedSampler
 
 from collections import defaultdict
 from datasets import load_dataset, dataset_dict, Dataset
 
 from torch.nn.utils.rnn import pad_sequence
 from utils.utils import Label
+from utils.token_dataset import TokenizedDataset, TokenizationCache, tokenized_path, convert_to_features
+from utils.length_sampler import LengthBucketSampler, padding_ratio, sequential_batches
+from utils.distributed import get_rank_and_world_size
+from utils.folds import load_fold
 from collections import OrderedDict
 
 from transformers import (
@@ -50,6 +55,7 @@ class ErrorCheckerDataModule(pl.LightningDataModule):
         self.tokenizer = AutoTokenizer.from_pretrained(self.model_name,
                                                        use_fast=True,
                                                        add_prefix_space=True)
+        self.train_sampler = None
 
     def setup(self, stage):
         data_dir = os.path.join("data", self.args.dataset)
@@ -59,89 +65,158 @@ class ErrorCheckerDataModule(pl.LightningDataModule):
         elif stage == "predict":
             splits = ["dev", "test"]
 
-        self.dataset = {
-            split : load_dataset("json", data_files=os.path.join(data_dir, f"{split}.json"), field="data", split="train") 
-                    for split in splits
-        }
+        if self.args.fold is not None:
+            # the splits of the cross-validation fold are selected from the whole dataset by the indices in the manifest
+            dataset = self._load_tokenized(data_dir, "all")
+            fold = load_fold(os.path.join(data_dir, "folds.json"), self.args.fold, n_examples=len(dataset))
+            logger.info(f"Using fold {self.args.fold}: " + ", ".join(f"{split} {len(fold[split])}" for split in splits))
 
-        for split in self.dataset.keys():
-            self.dataset[split] = self.dataset[split].map(
-                self._convert_to_features,
-                batched=True,
-                remove_columns=['labels'],
-            )
-            self.dataset[split].set_format(
-                type="torch",
-                columns=[
-                    "attention_mask", "input_ids", "labels"
-                ])
+            self.dataset = {split : self._select(dataset, fold[split]) for split in splits}
+        else:
+            self.dataset = {split : self._load_tokenized(data_dir, split) for split in splits}
+
+
+    def _load_tokenized(self, data_dir, split):
+        """
+        Returns the tokenized split: the pre-tokenized dataset, the dataset from the tokenization cache
+        or the split tokenized with the Huggingface datasets
+        """
+        # use the pre-tokenized dataset if it was created for the same tokenizer, maximum length and data file
+        tok_path = tokenized_path(os.path.join(data_dir, split), self.model_name, self.args.max_length, self.args.ctx)
+
+        if TokenizedDataset.is_valid(tok_path, self.tokenizer, self.args.max_length, source_path=self._split_path(data_dir, split)):
+            logger.info(f"Loading pre-tokenized {split} split from {tok_path}")
+            return TokenizedDataset(tok_path)
+
+        if self.args.tokenization_cache:
+            return TokenizationCache(self.args.tokenization_cache).get(
+                self._split_path(data_dir, split), self.tokenizer, self.args.max_length, self.args.ctx)
+
+        dataset = self._load_split(data_dir, split).map(
+            self._convert_to_features,
+            batched=True,
+            remove_columns=['labels'],
+        )
+        dataset.set_format(
+            type="torch",
+            columns=[
+                "attention_mask", "input_ids", "labels"
+            ])
+
+        return dataset
+
+
+    def _select(self, dataset, indices):
+        if isinstance(dataset, TokenizedDataset):
+            return Subset(dataset, indices)
+
+        return dataset.select(indices)
+
+
+    def _split_path(self, data_dir, split):
+        """
+        Returns the path of the split, either a JSONL file (one example per line) or a JSON file with the "data" field
+        """
+        jsonl_path = os.path.join(data_dir, f"{split}.jsonl")
+
+        if os.path.exists(jsonl_path):
+            return jsonl_path
+
+        return os.path.join(data_dir, f"{split}.json")
+
+
+    def _load_split(self, data_dir, split):
+        path = self._split_path(data_dir, split)
+
+        if path.endswith(".jsonl"):
+            return load_dataset("json", data_files=path, split="train")
+
+        return load_dataset("json", data_files=path, field="data", split="train")
 
 
     def _convert_to_features(self, example_batch, indices=None):
-        ctx = example_batch["ctx"]
-        sent = example_batch["sent"]
+        return convert_to_features(self.tokenizer, example_batch, self.args.max_length, self.args.ctx)
+
 
-        features = self.tokenizer(ctx, sent, 
-            is_split_into_words=True, 
-            return_offsets_mapping=True,
-            max_length=self.args.max_length,
-            truncation='only_first')
+    def _get_lengths(self, dataset):
+        """
+        Returns the number of tokens in each example of the dataset
+        """
+        if isinstance(dataset, TokenizedDataset):
+            return dataset.lengths()
 
-        features['labels'] = self._align_labels_with_tokens(
-            features, example_batch['labels'])
+        if isinstance(dataset, Subset):
+            lengths = self._get_lengths(dataset.dataset)
+            return [lengths[i] for i in dataset.indices]
 
-        return features
+        return [len(input_ids) for input_ids in dataset.with_format(None)["input_ids"]]
 
 
-    def _align_labels_with_tokens(self, features, labels):
-        aligned_labels_batch = []
-        label_map = Label.label2id()
-        do_not_care_label = -100
+    def get_train_sampler(self):
+        """
+        Returns the length-bucketed batch sampler for the training data (created on the first call)
+        """
+        # each process takes its own shard of the batches in distributed training
+        rank, world_size = get_rank_and_world_size()
 
-        for b in range(len(labels)):
-            aligned_labels = []
+        if self.train_sampler is None or (self.train_sampler.rank, self.train_sampler.num_replicas) != (rank, world_size):
+            lengths = self._get_lengths(self.dataset['train'])
+            self.train_sampler = LengthBucketSampler(lengths,
+                                                     batch_size=None if self.args.max_tokens else self.args.batch_size,
+                                                     max_tokens=self.args.max_tokens,
+                                                     seed=self.args.seed,
+                                                     num_replicas=world_size,
+                                                     rank=rank)
+            logger.info(f"Padding ratio with batches in the dataset order: "
+                        f"{padding_ratio(lengths, sequential_batches(len(lengths), self.args.batch_size)):.1%}")
 
-            # compute loss only for the hypothesis, skip the context
-            active = False
-            prev_input_id = None
-            
-            for i, (input_id, word) in enumerate(zip(features["input_ids"][b], features.words(b))):
-                aligned_label = do_not_care_label
+        return self.train_sampler
 
-                # align with word in case a new word started
-                # word is None for BOS and EOS
-                if active and word is not None and features.words(b)[i-1] != word:
-                    aligned_label = label_map[labels[b][word]]
 
-                if prev_input_id == input_id == self.tokenizer.sep_token_id:
-                    active = True
+    def _num_workers(self):
+        # the CPU cores are used by the training processes in CPU data-parallel training
+        return 0 if self.args.cpu_processes else self.args.max_threads
 
-                aligned_labels.append(aligned_label)
-                prev_input_id = input_id
 
-            assert len(features['input_ids'][b]) == len(aligned_labels)
-            aligned_labels_batch.append(aligned_labels)
+    def _distributed_sampler(self, dataset, shuffle):
+        """
+        Returns a sampler with the shard of the dataset for the process in CPU data-parallel training
+        (the samplers are not replaced by Pytorch Lightning in this mode), None otherwise
+        """
+        rank, world_size = get_rank_and_world_size()
 
-        return aligned_labels_batch
+        if world_size == 1:
+            return None
+
+        return DistributedSampler(dataset, num_replicas=world_size, rank=rank, shuffle=shuffle, seed=self.args.seed)
 
 
     def train_dataloader(self):
+        if self.args.bucket_by_length or self.args.max_tokens:
+            return DataLoader(self.dataset['train'],
+                              batch_sampler=self.get_train_sampler(),
+                              num_workers=self._num_workers(),
+                              collate_fn=self._pad_sequence)
+
         return DataLoader(self.dataset['train'],
                           batch_size=self.args.batch_size,
-                          num_workers=self.args.max_threads,
+                          sampler=self._distributed_sampler(self.dataset['train'], shuffle=True),
+                          num_workers=self._num_workers(),
                           collate_fn=self._pad_sequence,
                           )
 
     def val_dataloader(self):
         return DataLoader(self.dataset['dev'],
                           batch_size=self.args.batch_size,
-                          num_workers=self.args.max_threads,
+                          sampler=self._distributed_sampler(self.dataset['dev'], shuffle=False),
+                          num_workers=self._num_workers(),
                           collate_fn=self._pad_sequence)
 
     def test_dataloader(self):
         return DataLoader(self.dataset['test'],
                           batch_size=self.args.batch_size,
-                          num_workers=self.args.max_threads,
+                          sampler=self._distributed_sampler(self.dataset['test'], shuffle=False),
+                          num_workers=self._num_workers(),
                           collate_fn=self._pad_sequence)
 
 
@@ -179,6 +254,10 @@ class ErrorChecker(pl.LightningModule):
                 label2id=Label.label2id()
             )
 
+        if getattr(self.args, "num_layers", None):
+            # a smaller model initialized with the first `num_layers` layers of the pretrained model
+            config.num_hidden_layers = self.args.num_layers
+
         self.model = AutoModelForTokenClassification.from_pretrained(args.model_name,
                                               config=config)
 
@@ -267,6 +346,85 @@ class ErrorChecker(pl.LightningModule):
 
 
 
+class DistillationErrorChecker(ErrorChecker):
+    """
+    Student model trained with the soft token-level targets from a trained ErrorChecker (the teacher)
+    in addition to the gold labels. The teacher is not saved in the checkpoints, so the student can be loaded
+    as an ErrorChecker.
+    """
+    def __init__(self, args, **kwargs):
+        super().__init__(args, **kwargs)
+
+        self.teacher = ErrorChecker.load_from_checkpoint(self.args.teacher_path)
+        self.teacher.freeze()
+        logger.info(f"Loaded teacher model from {self.args.teacher_path}")
+
+        # the student and the teacher have to share the tokenization of the inputs
+        if self.teacher.tokenizer.get_vocab() != self.tokenizer.get_vocab():
+            raise ValueError(f"The tokenizer of {self.args.model_name} is not compatible with the teacher "
+                             f"({self.teacher.model.name_or_path})")
+
+    def train(self, mode=True):
+        super().train(mode)
+        # no dropout in the teacher
+        self.teacher.eval()
+
+        return self
+
+    def distillation_loss(self, student_logits, teacher_logits, mask):
+        """
+        KL divergence between the teacher and student distributions (softened by the temperature)
+        averaged over the tokens with the loss (the first tokens of the words in the hypothesis)
+        """
+        if not mask.any():
+            return student_logits.new_zeros(())
+
+        t = self.args.distill_temperature
+        student_log_probs = F.log_softmax(student_logits[mask] / t, dim=-1)
+        teacher_probs = F.softmax(teacher_logits[mask] / t, dim=-1)
+
+        return F.kl_div(student_log_probs, teacher_probs, reduction="batchmean") * t**2
+
+    def training_step(self, batch, batch_idx):
+        labels = batch["labels"]
+        input_ids = batch["input_ids"]
+        attention_mask = batch["attention_mask"]
+
+        outputs = self(input_ids=input_ids,
+                       attention_mask=attention_mask,
+                       labels=labels)
+
+        with torch.no_grad():
+            teacher_logits = self.teacher.model(input_ids=input_ids,
+                                                attention_mask=attention_mask)["logits"]
+
+        distill_loss = self.distillation_loss(outputs["logits"], teacher_logits, labels != -100)
+        loss = self.args.distill_alpha * distill_loss + (1 - self.args.distill_alpha) * outputs["loss"]
+
+        self.log('loss/train', loss, prog_bar=True)
+        self.log('loss/distill', distill_loss)
+        return loss
+
+    def on_save_checkpoint(self, checkpoint):
+        checkpoint["state_dict"] = {k : v for k, v in checkpoint["state_dict"].items() if not k.startswith("teacher.")}
+
+    @staticmethod
+    def add_model_specific_args(parent_parser):
+        parser = argparse.ArgumentParser(parents=[parent_parser],
+                                         add_help=False)
+        parser.add_argument("--teacher_path", type=str, default=None,
+            help="Path to the checkpoint of a trained model used as a teacher for knowledge distillation.")
+        parser.add_argument("--distill_temperature", default=2.0, type=float,
+            help="Temperature for softening the teacher and student distributions.")
+        parser.add_argument("--distill_alpha", default=0.5, type=float,
+            help="Weight of the distillation loss (the loss on the gold labels has the weight 1-alpha).")
+        parser.add_argument("--num_layers", default=None, type=int,
+            help="Use only the first N layers of the pretrained model (e.g. a 6-layer student).")
+
+        return parser
+
+
+
 class ErrorCheckerInferenceModule:
     """
     Class used for decoding and interactive inference, a wrapper on top of the ErrorChecker module 
@@ -8,34 +8,50 @@ import random
 import re
 
 from collections import defaultdict
+from nltk import word_tokenize
 from utils.rotowire import Rotowire
+from utils.utils import SubstitutionTable
 
 logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO, datefmt='%H:%M:%S')
 logger = logging.getLogger(__name__)
 
 class GameData:
     """
-    Data structure for generated sentences about a game
+    Data structure for generated sentences about a game.
+    The tables of teams and players (with their tokenized forms) are built on the first access and kept
+    for the rest of the run, so loading the games does not read the entities of games which are never used.
     """
-    def __init__(self, game_id, rotowire):
-        self.teams = rotowire.get_teams(game_id)
-        self.players = rotowire.get_players(game_id)
+    __slots__ = ["game_id", "split", "templates", "rotowire", "teams", "players", "texts"]
+
+    def __init__(self, game_id, rotowire, templates=None):
+        self.game_id = game_id
+        self.split = rotowire.split
+        self.templates = templates
+        self.rotowire = rotowire
+        self.teams = None
+        self.players = None
         self.texts = []
 
     def get_all(self):
         return self.texts
 
     def get_teams(self):
+        if self.teams is None:
+            self.teams = SubstitutionTable(self.rotowire.get_teams(self.game_id), tokenize=word_tokenize)
+
         return self.teams
 
     def get_players(self):
+        if self.players is None:
+            self.players = SubstitutionTable(self.rotowire.get_players(self.game_id), tokenize=word_tokenize)
+
         return self.players
 
     def add_text(self, text):
         self.texts.append(text)
 
 
-def load_games(template_path, rotowire_dir, split="test", normalize=True):
+def load_games(template_path, rotowire_dir, split="test", normalize=True, rotowire=None):
     """
     Load the generated sentences from the text file into data structures
     """
@@ -43,7 +59,9 @@ def load_games(template_path, rotowire_dir, split="test", normalize=True):
     game_data = None
     skipped_ids = []
     game_id = 0
-    rotowire = Rotowire(rotowire_dir, split)
+    if rotowire is None:
+        rotowire = Rotowire(rotowire_dir, split)
+    templates = os.path.basename(os.path.normpath(template_path))
 
     with open(template_path + f"/{split}.txt") as f:
         for line in f.readlines():
@@ -71,7 +89,7 @@ def load_games(template_path, rotowire_dir, split="test", normalize=True):
                         logger.info(f"Game id {game_id} skipped")
                         games.append(None)
                         game_id += 1
-                game_data = GameData(game_id, rotowire)
+                game_data = GameData(game_id, rotowire, templates)
             elif skipped_id is not None:
                 skipped_ids.append(int(skipped_id.group(1)))
             elif line == "" or not game_data or re.search(r"(Game|Player|Team) Data", line):
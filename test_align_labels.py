@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Checks that the vectorized label alignment (utils.token_dataset.align_labels_with_tokens) gives
+the same labels as the original implementation (benchmark.align_labels_reference)
+"""
+
+import random
+
+from utils.utils import Label
+from utils.token_dataset import align_labels_with_tokens, DO_NOT_CARE_LABEL
+from benchmark import align_labels_reference
+
+BOS, SEP = 0, 2
+
+
+class Tokenizer:
+    sep_token_id = SEP
+
+
+class Features(dict):
+    """
+    Imitates the output of a fast tokenizer for a batch of (context, hypothesis) pairs in the RoBERTa format:
+    <s> context </s></s> hypothesis </s>
+    """
+    def __init__(self, input_ids, word_ids):
+        super().__init__(input_ids=input_ids)
+        self._word_ids = word_ids
+
+    def word_ids(self, b):
+        return self._word_ids[b]
+
+    def words(self, b):
+        return self._word_ids[b]
+
+
+def encode(ctx, sent, max_length=None):
+    """
+    Returns input ids and word ids for a pair of the context and the hypothesis (or for the hypothesis only
+    if `ctx` is None), the words are given as lists of subword ids. The context is truncated to `max_length`.
+    """
+    sent_ids = [(token, word) for word, subwords in enumerate(sent) for token in subwords]
+
+    if ctx is None:
+        tokens = [(BOS, None)] + sent_ids + [(SEP, None)]
+    else:
+        ctx_ids = [(token, word) for word, subwords in enumerate(ctx) for token in subwords]
+
+        if max_length is not None:
+            ctx_ids = ctx_ids[:max(0, max_length - len(sent_ids) - 4)]
+
+        tokens = [(BOS, None)] + ctx_ids + [(SEP, None), (SEP, None)] + sent_ids + [(SEP, None)]
+
+    return [token for token, _ in tokens], [word for _, word in tokens]
+
+
+def random_words(n):
+    # subword ids never collide with the special tokens
+    return [[random.randint(5, 100) for _ in range(random.randint(1, 3))] for _ in range(n)]
+
+
+def random_labels(n):
+    return [random.choice(list(Label)).name for _ in range(n)]
+
+
+def align(pairs, labels):
+    encoded = [encode(*pair) for pair in pairs]
+    features = Features([input_ids for input_ids, _ in encoded], [word_ids for _, word_ids in encoded])
+    tokenizer = Tokenizer()
+
+    reference = align_labels_reference(tokenizer, features, labels)
+    vectorized = align_labels_with_tokens(tokenizer, features, labels)
+
+    assert vectorized == reference, f"Different labels:\n{reference}\n{vectorized}"
+
+    return vectorized
+
+
+def test_with_separator():
+    sent = [[10], [11, 12], [13, 14, 15], [16]]
+    labels = ["O", "NAME", "NUMBER", "O"]
+    aligned = align([(random_words(5), sent)], [labels])[0]
+
+    # the labels are assigned only to the first subword of each word in the hypothesis
+    assert [label for label in aligned if label != DO_NOT_CARE_LABEL] == [Label[label].value for label in labels]
+
+
+def test_without_separator():
+    aligned = align([(None, random_words(4))], [random_labels(4)])[0]
+
+    assert all(label == DO_NOT_CARE_LABEL for label in aligned)
+
+
+def test_empty():
+    align([(random_words(5), [])], [[]])
+    align([([], random_words(3))], [random_labels(3)])
+    align([([], [])], [[]])
+
+
+def test_truncation():
+    sent = random_words(6)
+    labels = random_labels(6)
+    aligned = align([(random_words(50), sent, 30)], [labels])[0]
+
+    assert len(aligned) <= 30
+    assert sum(label != DO_NOT_CARE_LABEL for label in aligned) == len(labels)
+
+
+def test_random():
+    random.seed(42)
+
+    for _ in range(200):
+        pairs, labels = [], []
+
+        for _ in range(random.randint(1, 8)):
+            n_words = random.randint(0, 10)
+            ctx = None if random.random() < 0.1 else random_words(random.randint(0, 30))
+            max_length = random.choice([None, 16, 32, 64])
+            pairs.append((ctx, random_words(n_words), max_length))
+            labels.append(random_labels(n_words))
+
+        align(pairs, labels)
+
+
+if __name__ == '__main__':
+    test_with_separator()
+    test_without_separator()
+    test_empty()
+    test_truncation()
+    test_random()
+    print("OK")
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Checks that the streaming output of CompactJSONEncoder.dump and DatasetWriter is identical
+to json.dumps(..., cls=CompactJSONEncoder)
+"""
+
+import io
+import os
+import json
+import tempfile
+
+from utils.json_encoder import CompactJSONEncoder
+from utils.dataset_writer import DatasetWriter
+
+long_tokens = ["token"] * (CompactJSONEncoder.MAX_ITEMS + 1)
+wide_tokens = ["x" * 1000] * 60
+long_numbers = list(range(CompactJSONEncoder.MAX_ITEMS + 1))
+
+OBJECTS = [
+    [],
+    {},
+    [[], {}],
+    {"a" : [], "b" : {}},
+    [1, 2.5, 1e-10, True, None, "str"],
+    {"nested" : {"list" : [[1, 2], ["a", "b"], [{"c" : 1}]], "empty" : []}},
+    [[["deep"]], {"x" : [{"y" : {"z" : [1]}}]}],
+    long_tokens,
+    wide_tokens,
+    long_numbers,
+    {"ctx" : long_tokens, "sent" : wide_tokens, "labels" : long_numbers},
+    ["Dončić", "Nenê", "São Paulo", "Ελλάδα", "👍"],
+    {"Dončić" : ["Nenê", "line\nbreak"], "ünïcödé" : {"ö" : 1}},
+]
+
+EXAMPLES = [
+    {"ctx" : ["The", "Celtics", "scored", "113", "points"], "sent" : ["Dončić", "scored"], "labels" : ["NAME", "O"]},
+    {"ctx" : long_tokens, "sent" : wide_tokens, "labels" : ["O"] * len(wide_tokens)},
+    {"ctx" : [], "sent" : [], "labels" : []},
+    {"ctx_sents" : [["The", "Celtics"], [], ["São", "Paulo"]], "sent" : ["a\nb"], "labels" : ["O"]},
+]
+
+
+def test_dump():
+    for o in OBJECTS:
+        fp = io.StringIO()
+        CompactJSONEncoder(indent=4).dump(o, fp)
+        expected = json.dumps(o, ensure_ascii=False, indent=4, cls=CompactJSONEncoder)
+
+        assert fp.getvalue() == expected, f"Different output for {str(o)[:100]}"
+
+
+def test_dataset_writer():
+    tmp_dir = tempfile.mkdtemp()
+
+    for examples in [EXAMPLES, EXAMPLES[:1], [], OBJECTS[4:7]]:
+        path = os.path.join(tmp_dir, "dataset")
+
+        with DatasetWriter(path, fmt="json") as writer:
+            writer.write_all(examples)
+
+        with open(writer.path) as f:
+            output = f.read()
+
+        assert output == json.dumps({"data" : examples}, ensure_ascii=False, indent=4, cls=CompactJSONEncoder)
+        assert json.loads(output)["data"] == examples
+
+
+if __name__ == '__main__':
+    test_dump()
+    test_dataset_writer()
+    print("OK")
@@ -3,15 +3,19 @@
 A script for running the model training.
 """
 
-from model import ErrorChecker, ErrorCheckerDataModule
+from model import ErrorChecker, ErrorCheckerDataModule, DistillationErrorChecker
 
 import logging
 import argparse
 import os
 import warnings
 
+import torch
 import pytorch_lightning as pl
 
+from utils.distributed import ThreadPinning
+from utils.throughput import ThroughputMonitor
+
 logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO, datefmt='%H:%M:%S')
 logger = logging.getLogger(__name__)
 
@@ -20,6 +24,7 @@ def parse_args(args=None):
     parser = pl.Trainer.add_argparse_args(parser)
     parser = ErrorCheckerDataModule.add_argparse_args(parser)
     parser = ErrorChecker.add_model_specific_args(parser)
+    parser = DistillationErrorChecker.add_model_specific_args(parser)
 
     parser.add_argument("--model_name", type=str, default="roberta-base",
         help="Name of the model from the Huggingface Transformers library.")
@@ -37,12 +42,35 @@ def parse_args(args=None):
         help="Experiment name used for naming the experiment directory")
     parser.add_argument("--max_length", type=int, default=512,
         help="Maximum number of tokens per example")
+    parser.add_argument("--bucket_by_length", action="store_true",
+        help="Group the training examples of similar length into batches to reduce padding.")
+    parser.add_argument("--max_tokens", type=int, default=None,
+        help="Token budget for length-bucketed batches (number of examples x longest example), "
+        "replaces the fixed batch size.")
+    parser.add_argument("--ctx", type=int, default=None,
+        help="Number of context sentences used for training on a dataset with the ranked context sentences "
+        "(generated with --shared_ctx, all the sentences by default).")
+    parser.add_argument("--fold", type=int, default=None,
+        help="Cross-validation fold used for training on a dataset generated with --xval_splits.")
+    parser.add_argument("--log_throughput", action="store_true",
+        help="Log the training throughput, padding, data loading time and peak memory for each step "
+        "and save a summary to throughput.json in the experiment directory.")
+    parser.add_argument("--tokenization_cache", type=str, default="cache/tokenized",
+        help="Directory with the cache of tokenized datasets shared across experiments (use an empty string to disable).")
     parser.add_argument("--seed", default=42, type=int,
         help="Random seed.")
     parser.add_argument("--max_threads", default=8, type=int,
         help="Maximum number of CPU threads.")
+    parser.add_argument("--cpu_processes", default=None, type=int,
+        help="Train with distributed data-parallel on CPU with this number of local processes (gloo backend). "
+        "The --max_threads are divided among the processes.")
     
-    return parser.parse_args(args)
+    args = parser.parse_args(args)
+
+    if args.teacher_path and args.model_path:
+        parser.error("The student model for distillation is initialized from --model_name, --model_path cannot be used.")
+
+    return args
 
 
 if __name__ == '__main__':
@@ -51,11 +79,14 @@ if __name__ == '__main__':
     logger.info(args)
 
     pl.seed_everything(args.seed)
+    torch.set_num_threads(args.max_threads)
     dm = ErrorCheckerDataModule(args)
     dm.prepare_data()
     dm.setup('fit')
 
-    if args.model_path:
+    if args.teacher_path:
+        model = DistillationErrorChecker(args)
+    elif args.model_path:
         model = ErrorChecker.load_from_checkpoint(args.model_path)
     else:
         model = ErrorChecker(args)
@@ -76,6 +107,20 @@ if __name__ == '__main__':
         mode=mode
     )
 
-    trainer = pl.Trainer.from_argparse_args(args, 
-        callbacks=[checkpoint_callback], accelerator='dp')
+    callbacks = [checkpoint_callback]
+
+    if args.log_throughput:
+        callbacks.append(ThroughputMonitor(os.path.join(ckpt_output_dir, "throughput.json")))
+
+    if args.cpu_processes:
+        # the processes shard the data themselves, see ErrorCheckerDataModule
+        trainer = pl.Trainer.from_argparse_args(args,
+            callbacks=callbacks + [ThreadPinning(args.max_threads)],
+            accelerator='ddp_cpu',
+            num_processes=args.cpu_processes,
+            gpus=None,
+            replace_sampler_ddp=False)
+    else:
+        trainer = pl.Trainer.from_argparse_args(args, 
+            callbacks=callbacks, accelerator=args.accelerator or 'dp')
     trainer.fit(model, dm)
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+
+import re
+import math
+import heapq
+import logging
+from collections import OrderedDict, Counter, defaultdict
+
+logger = logging.getLogger(__name__)
+
+
+def tokenize(text):
+    return re.findall(r"\w+", text.lower())
+
+
+class BM25Index:
+    """
+    Inverted index over the sentences generated for a game
+    """
+    def __init__(self, texts, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.n_docs = len(texts)
+        self.postings = defaultdict(list)
+        self.doc_lens = []
+
+        for doc_idx, text in enumerate(texts):
+            tokens = tokenize(text)
+            self.doc_lens.append(len(tokens))
+
+            for term, tf in Counter(tokens).items():
+                self.postings[term].append((doc_idx, tf))
+
+        self.avg_doc_len = sum(self.doc_lens) / max(self.n_docs, 1)
+        self.idf = {
+            term : math.log(1 + (self.n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self.postings.items()
+        }
+
+    def scores(self, query):
+        """
+        Returns BM25 scores of all the documents for the query
+        """
+        scores = [0.0] * self.n_docs
+
+        for term in set(tokenize(query)):
+            if term not in self.postings:
+                continue
+
+            idf = self.idf[term]
+
+            for doc_idx, tf in self.postings[term]:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lens[doc_idx] / self.avg_doc_len)
+                scores[doc_idx] += idf * tf * (self.k1 + 1) / (tf + norm)
+
+        return scores
+
+
+class BM25Scorer:
+    """
+    Use BM25 over an inverted index to retrieve relevant sentences out of all sentences
+    generated for a game. Provides the same interface as SentenceScorer without the need
+    for running a neural encoder.
+
+    The index for a game is built only once and kept in a LRU cache holding at most
+    `cache_size` games (0 disables the cache).
+    """
+    def __init__(self, cache_size=128):
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+
+    def load_store(self, store_dir, template_path, split, games):
+        logger.info("Embedding store is not used by the BM25 retriever")
+
+    def get_index(self, game_data):
+        if game_data in self.cache:
+            self.cache.move_to_end(game_data)
+            return self.cache[game_data]
+
+        index = BM25Index(game_data.get_all())
+
+        if self.cache_size > 0:
+            self.cache[game_data] = index
+
+            if len(self.cache) > self.cache_size:
+                # evict the least recently used game
+                self.cache.popitem(last=False)
+
+        return index
+
+    def rank(self, sentences, game_data, cnt):
+        """
+        Returns a list of tuples (text_idx, bm25_score) with `cnt` best scored texts for each of the sentences
+        """
+        index = self.get_index(game_data)
+
+        return [
+            heapq.nlargest(cnt, enumerate(index.scores(sentence)), key=lambda x: x[1])
+            for sentence in sentences
+        ]
+
+    def retrieve_ctx_scored_batch(self, sentences, game_data, cnt):
+        """
+        Returns a list of tuples (sentence, sim_score) for each of the sentences
+        """
+        texts = game_data.get_all()
+
+        return [
+            [(texts[idx], score) for idx, score in ranked]
+            for ranked in self.rank(sentences, game_data, cnt)
+        ]
+
+    def retrieve_ctx_scored(self, sentence, game_data, cnt):
+        """
+        Returns a list of tuples (sentence, sim_score)
+        """
+        return self.retrieve_ctx_scored_batch([sentence], game_data, cnt)[0]
+
+    def retrieve_ctx(self, sentence, game_data, cnt):
+        """
+        Returns a paragraph with context (concatenated relevant sentences)
+        """
+        scored_sentences = self.retrieve_ctx_scored(sentence, game_data, cnt)
+        text = " ".join([x[0] for x in scored_sentences])
+
+        return text
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import shutil
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def args_hash(args, ignore=()):
+    """
+    Returns a hash of the arguments (except the ignored ones) identifying a run
+    """
+    key = {k : v for k, v in sorted(vars(args).items()) if k not in ignore}
+
+    return hashlib.sha1(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+class GenerationCheckpoint:
+    """
+    Checkpoint of a generation run. The examples for each completed game are saved in a separate
+    shard file and the game is committed to the manifest (one JSON entry per line) with the number of examples,
+    the hash of the shard contents and the counts of the entities.
+
+    The shards duplicate the generated data, the checkpoint is therefore removed once the run is complete.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.manifest_path = os.path.join(path, "manifest.jsonl")
+        os.makedirs(os.path.join(path, "games"), exist_ok=True)
+
+    def _shard_path(self, game_id):
+        return os.path.join(self.path, "games", f"{game_id:04d}.json")
+
+    def load(self):
+        """
+        Returns a dictionary game_id -> manifest entry for the completed games
+        """
+        entries = {}
+
+        if not os.path.exists(self.manifest_path):
+            return entries
+
+        with open(self.manifest_path) as f:
+            lines = f.readlines()
+
+        if lines and not lines[-1].endswith("\n"):
+            # the job was killed while writing the last entry, start the next entry on a new line
+            with open(self.manifest_path, "a") as f:
+                f.write("\n")
+
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+            try:
+                with open(self._shard_path(entry["game_id"]), "rb") as f_shard:
+                    content_hash = hashlib.sha1(f_shard.read()).hexdigest()
+            except FileNotFoundError:
+                continue
+
+            if content_hash == entry["hash"]:
+                entries[entry["game_id"]] = entry
+
+        logger.info(f"{len(entries)} completed games found in {self.path}")
+
+        return entries
+
+    def commit(self, game_id, examples, examples_cnt, ents_cnt, ents_mod_cnt):
+        content = json.dumps(examples, ensure_ascii=False).encode("utf-8")
+        path = self._shard_path(game_id)
+        tmp_path = path + ".tmp"
+
+        with open(tmp_path, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+        entry = {
+            "game_id" : game_id,
+            "examples" : examples_cnt,
+            "hash" : hashlib.sha1(content).hexdigest(),
+            "ents_cnt" : ents_cnt,
+            "ents_mod_cnt" : ents_mod_cnt
+        }
+        with open(self.manifest_path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def get(self, game_id):
+        with open(self._shard_path(game_id)) as f:
+            return json.load(f)
+
+    def remove(self):
+        """
+        Removes the checkpoint after the output of the run has been written completely
+        """
+        shutil.rmtree(self.path)
+        logger.info(f"Checkpoint {self.path} removed")
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+import os
+import json
+
+from utils.json_encoder import CompactJSONEncoder
+
+
+class DatasetWriter:
+    """
+    Writes the generated examples to a file in one of the formats:
+
+    json - a single JSON object {"data" : [examples]} formatted using CompactJSONEncoder
+    jsonl - one example per line
+
+    In both formats, the examples are written to a temporary file as soon as they are produced. The file is moved
+    to `path` only when the writer is closed; if an exception is raised in the `with` block, the output is discarded.
+
+    If a tokenizer is given, the examples are also written to a pre-tokenized binary dataset
+    (see `utils.token_dataset`) which can be loaded for training without tokenization.
+    """
+    FORMATS = ["json", "jsonl"]
+
+    def __init__(self, path, fmt="json", tokenizer=None, max_length=512):
+        if fmt not in self.FORMATS:
+            raise ValueError(f"Unknown format {fmt}, use one of {self.FORMATS}")
+
+        self.fmt = fmt
+        self.path = f"{path}.{fmt}"
+        self.tmp_path = f"{self.path}.tmp{os.getpid()}"
+        self.f = open(self.tmp_path, "w")
+        self.encoder = CompactJSONEncoder(indent=4)
+        self.examples_cnt = 0
+        self.tokenized_writer = None
+
+        if tokenizer is not None:
+            from utils.token_dataset import TokenizedDatasetWriter, tokenized_path
+
+            self.tokenized_writer = TokenizedDatasetWriter(tokenized_path(path, tokenizer.name_or_path, max_length),
+                                                           tokenizer, max_length, source_path=self.path)
+
+        if self.fmt == "json":
+            self.f.write('{\n' + self.encoder.INDENTATION_CHAR*self.encoder.indent + '"data": [')
+
+    def write(self, example):
+        if self.fmt == "jsonl":
+            self.f.write(json.dumps(example, ensure_ascii=False) + "\n")
+        else:
+            # same layout as json.dumps({"data" : examples}, indent=4, cls=CompactJSONEncoder)
+            # for examples which are containers
+            self.f.write(("\n" if self.examples_cnt == 0 else ",\n") + self.encoder.INDENTATION_CHAR*2*self.encoder.indent)
+            self.encoder.dump(example, self.f, indentation_level=2)
+
+        if self.tokenized_writer:
+            self.tokenized_writer.write(example)
+
+        self.examples_cnt += 1
+
+    def write_all(self, examples):
+        for example in examples:
+            self.write(example)
+
+    def close(self):
+        if self.fmt == "json":
+            self.f.write("]\n}" if self.examples_cnt == 0 else "\n" + self.encoder.INDENTATION_CHAR*self.encoder.indent + "]\n}")
+
+        self.f.close()
+        os.replace(self.tmp_path, self.path)
+
+        # closed after the data file, the metadata refers to its final version
+        if self.tokenized_writer:
+            self.tokenized_writer.close()
+
+    def abort(self):
+        """
+        Discards the output, neither the data file nor the pre-tokenized dataset is saved
+        """
+        self.f.close()
+        os.remove(self.tmp_path)
+
+        if self.tokenized_writer:
+            self.tokenized_writer.abort()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # incomplete output is never saved
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+
+def read_examples(path):
+    """
+    Yields the examples from a file written by `DatasetWriter` (the format is given by the extension)
+    """
+    with open(path) as f:
+        if path.endswith(".jsonl"):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from json.load(f)["data"]
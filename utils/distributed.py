@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+
+import os
+import logging
+
+import torch
+import pytorch_lightning as pl
+
+logger = logging.getLogger(__name__)
+
+
+def pin_threads(rank, num_processes, max_threads):
+    """
+    Limit the number of threads of the process to its share of `max_threads` and pin the process
+    to its own set of CPU cores, so that the processes on one host do not compete for the cores.
+
+    Returns the number of threads of the process.
+    """
+    n_threads = max(1, max_threads // num_processes)
+    torch.set_num_threads(n_threads)
+
+    if hasattr(os, "sched_setaffinity"):
+        cores = sorted(os.sched_getaffinity(0))
+        process_cores = cores[rank*n_threads:(rank+1)*n_threads]
+
+        # do not pin if there are less available cores than requested threads
+        if len(process_cores) == n_threads:
+            os.sched_setaffinity(0, process_cores)
+
+    return n_threads
+
+
+def get_rank_and_world_size():
+    """
+    Returns the rank of the process and the number of processes (0 and 1 if not running distributed)
+    """
+    if torch.distributed.is_available() and torch.distributed.is_initialized():
+        return torch.distributed.get_rank(), torch.distributed.get_world_size()
+
+    return 0, 1
+
+
+class ThreadPinning(pl.Callback):
+    """
+    Pins the threads of each training process (see `pin_threads`). The hook is called in the
+    spawned processes, the ranks are therefore already known.
+    """
+    def __init__(self, max_threads):
+        self.max_threads = max_threads
+
+    def on_pretrain_routine_start(self, trainer, pl_module):
+        n_threads = pin_threads(trainer.local_rank, trainer.num_processes, self.max_threads)
+        logger.info(f"Process {trainer.global_rank}/{trainer.world_size}: {n_threads} threads")
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import hashlib
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def file_hash(path):
+    """
+    Returns a SHA-1 hash of the file contents
+    """
+    h = hashlib.sha1()
+
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+
+    return h.hexdigest()
+
+
+class EmbeddingStore:
+    """
+    On-disk store of the embeddings of the sentences generated for each game.
+
+    The store is located in `store_dir/model_name/templates/split` and contains a single
+    matrix with the embeddings of all the sentences in the template file, the offsets
+    of the individual games in the matrix, and metadata used for invalidating the store
+    if the template file changes. The matrix is memory-mapped (read-only) on load.
+    """
+    def __init__(self, store_dir, model_name, templates, split):
+        self.path = os.path.join(store_dir, model_name, templates, split)
+        self.model_name = model_name
+        self.embeddings = None
+        self.offsets = None
+
+    def _meta(self, template_file):
+        return {
+            "model_name" : self.model_name,
+            "template_hash" : file_hash(template_file)
+        }
+
+    def is_valid(self, template_file):
+        try:
+            with open(os.path.join(self.path, "meta.json")) as f:
+                meta = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return False
+
+        return meta == self._meta(template_file)
+
+    def load(self):
+        self.embeddings = np.load(os.path.join(self.path, "embeddings.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(self.path, "offsets.npy"))
+        logger.info(f"Loaded {self.embeddings.shape[0]} embeddings from {self.path}")
+
+    def build(self, games, model, template_file, chunk_size=10000):
+        """
+        Encode the sentences for all the games and save them to the store.
+
+        The sentences are encoded in chunks of at most `chunk_size` sentences and written directly to
+        a memory-mapped file, so the whole matrix is never held in the memory. The files are written
+        atomically so that the store can be shared by parallel jobs.
+        """
+        logger.info(f"Building the embedding store in {self.path}")
+        os.makedirs(self.path, exist_ok=True)
+
+        games = list(games)
+        offsets = [0]
+
+        for game_data in games:
+            offsets.append(offsets[-1] + (len(game_data.get_all()) if game_data is not None else 0))
+
+        suffix = f".tmp{os.getpid()}"
+        tmp_path = os.path.join(self.path, "embeddings" + suffix + ".npy")
+        embeddings = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32,
+            shape=(offsets[-1], model.get_sentence_embedding_dimension()))
+
+        chunk = []
+        chunk_start = 0
+
+        for i, game_data in enumerate(games):
+            if game_data is not None:
+                chunk += game_data.get_all()
+
+            if len(chunk) >= chunk_size or (i == len(games) - 1 and chunk):
+                embeddings[chunk_start:chunk_start+len(chunk)] = model.encode(chunk, convert_to_numpy=True, show_progress_bar=False)
+                chunk_start += len(chunk)
+                chunk = []
+
+        embeddings.flush()
+        del embeddings
+        os.replace(tmp_path, os.path.join(self.path, "embeddings.npy"))
+
+        tmp_path = os.path.join(self.path, "offsets" + suffix + ".npy")
+        np.save(tmp_path, np.array(offsets, dtype=np.int64))
+        os.replace(tmp_path, os.path.join(self.path, "offsets.npy"))
+
+        # metadata is written last, the store is not valid until then
+        tmp_path = os.path.join(self.path, "meta.json" + suffix)
+        with open(tmp_path, "w") as f:
+            json.dump(self._meta(template_file), f)
+        os.replace(tmp_path, os.path.join(self.path, "meta.json"))
+
+    def get(self, game_id):
+        """
+        Returns a read-only view of the embeddings for the game
+        """
+        return self.embeddings[self.offsets[game_id]:self.offsets[game_id+1]]
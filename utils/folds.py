@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+
+import os
+import json
+
+
+def get_xval_indices(n_examples, xval_splits, x):
+    """
+    Returns the indices of the examples in the train, dev and test split for the fold `x`.
+
+    The test split is the x-th contiguous block of the examples, the dev split is the half-sized block
+    following the test split (the first block for the last fold) and the rest is used for training.
+    """
+    test_size = n_examples // xval_splits
+    dev_size = test_size // 2
+
+    test_range = range(x*test_size, x*test_size+test_size)
+
+    if x != xval_splits-1:
+        dev_range = range(x*test_size+test_size, x*test_size+test_size+dev_size)
+    else:
+        dev_range = range(0, dev_size)
+
+    # the ranges overlap only for a single fold, the test split has the precedence
+    dev_indices = [i for i in dev_range if i not in test_range]
+    excluded = set(test_range) | set(dev_indices)
+
+    return {
+        "train" : [i for i in range(n_examples) if i not in excluded],
+        "dev" : dev_indices,
+        "test" : list(test_range)
+    }
+
+
+def write_fold_manifest(path, n_examples, xval_splits):
+    """
+    Saves the indices of the examples in the splits for all the folds
+    """
+    manifest = {
+        "n_examples" : n_examples,
+        "xval_splits" : xval_splits,
+        "folds" : [get_xval_indices(n_examples, xval_splits, x) for x in range(xval_splits)]
+    }
+    with open(path, "w") as f:
+        json.dump(manifest, f)
+
+
+def load_fold(path, x, n_examples=None):
+    """
+    Returns the indices of the examples in the splits for the fold `x`, checks that the manifest
+    corresponds to the dataset with `n_examples` examples
+    """
+    with open(path) as f:
+        manifest = json.load(f)
+
+    if n_examples is not None and manifest["n_examples"] != n_examples:
+        raise ValueError(f"The fold manifest {path} is for {manifest['n_examples']} examples, the dataset has {n_examples}")
+
+    if not 0 <= x < manifest["xval_splits"]:
+        raise ValueError(f"Fold {x} out of range, the manifest has {manifest['xval_splits']} folds")
+
+    return manifest["folds"][x]
@@ -52,6 +52,48 @@ class CompactJSONEncoder(json.JSONEncoder):
         else:
             return json.dumps(o)
 
+    def dump(self, o, fp, indentation_level=0):
+        """
+        Write JSON object *o* to the file handle *fp*. The output is identical to `encode`, but the
+        containers which do not fit on a single line are written piece by piece instead of building
+        the whole string in memory, so the time is linear in the size of the output. The lists of strings
+        (tokens, labels) are written at once without encoding each item separately.
+        """
+        if isinstance(o, (list, tuple)) and o and all(type(el) is str for el in o):
+            # fast path for the lists of tokens and labels, same escaping as in `encode`
+            if self._put_on_single_line(o):
+                fp.write("[" + ", ".join(self._encode_str(el) for el in o) + "]")
+            else:
+                indent_str = self.INDENTATION_CHAR*((indentation_level+1)*self.indent)
+                fp.write("[\n" + indent_str + (",\n" + indent_str).join(self._encode_str(el) for el in o)
+                    + "\n" + self.INDENTATION_CHAR*(indentation_level*self.indent) + "]")
+        elif isinstance(o, (list, tuple)) and not self._put_on_single_line(o):
+            indent_str = self.INDENTATION_CHAR*((indentation_level+1)*self.indent)
+            fp.write("[\n")
+
+            for i, el in enumerate(o):
+                fp.write(indent_str if i == 0 else ",\n" + indent_str)
+                self.dump(el, fp, indentation_level+1)
+
+            fp.write("\n" + self.INDENTATION_CHAR*(indentation_level*self.indent) + "]")
+        elif isinstance(o, dict) and o and not self._put_on_single_line(o):
+            indent_str = self.INDENTATION_CHAR*((indentation_level+1)*self.indent)
+            fp.write("{\n")
+
+            for i, (k, v) in enumerate(o.items()):
+                fp.write((indent_str if i == 0 else ",\n" + indent_str) + f"{json.dumps(k)}: ")
+                self.dump(v, fp, indentation_level+1)
+
+            fp.write("\n" + self.INDENTATION_CHAR*(indentation_level*self.indent) + "}")
+        else:
+            # primitives and containers with primitives only
+            self.indentation_level = indentation_level
+            fp.write(self.encode(o))
+
+    @staticmethod
+    def _encode_str(o):
+        return '"' + o.replace("\n", "\\n") + '"'
+
     def _put_on_single_line(self, o):
         return self._primitives_only(o) and len(o) <= self.MAX_ITEMS and len(str(o)) - 2 <= self.MAX_WIDTH
 
@@ -63,4 +105,12 @@ class CompactJSONEncoder(json.JSONEncoder):
 
     @property
     def indent_str(self) -> str:
-        return self.INDENTATION_CHAR*(self.indentation_level*self.indent)
\ No newline at end of file
+        return self.INDENTATION_CHAR*(self.indentation_level*self.indent)
+
+
+def dump(o, fp, indent=4):
+    """
+    Write JSON object *o* to the file handle *fp* in the same layout as
+    `json.dumps(o, indent=indent, cls=CompactJSONEncoder)`
+    """
+    CompactJSONEncoder(indent=indent).dump(o, fp)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+import random
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def padding_ratio(lengths, batches):
+    """
+    Returns the proportion of padding tokens if each batch is padded to its longest member
+    """
+    total = sum(lengths[i] for batch in batches for i in batch)
+    padded = sum(max(lengths[i] for i in batch) * len(batch) for batch in batches)
+
+    return 1 - total / padded if padded else 0.0
+
+
+class LengthBucketSampler:
+    """
+    Batch sampler grouping the examples of similar length to reduce padding.
+
+    In each epoch, the examples are shuffled and split into buckets of `bucket_size` examples. The examples
+    in each bucket are sorted by length and split into batches, either with a fixed number of examples
+    (`batch_size`) or with a token budget (`max_tokens`, the number of examples times the length of the longest one).
+    The order of the batches is shuffled, so the composition of the batches stays random.
+
+    For distributed training, all the processes create the same batches (using the same seed) and each process
+    takes every `num_replicas`-th batch. The batches are truncated so that all the processes have the same number of batches.
+    """
+    def __init__(self, lengths, batch_size=None, max_tokens=None, bucket_size=None, shuffle=True, seed=42,
+                 num_replicas=1, rank=0):
+        if (batch_size is None) == (max_tokens is None):
+            raise ValueError("Use either batch_size or max_tokens")
+
+        self.lengths = list(lengths)
+        self.batch_size = batch_size
+        self.max_tokens = max_tokens
+        self.bucket_size = bucket_size or 100 * (batch_size or 16)
+        self.shuffle = shuffle
+        self.seed = seed
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.epoch = 0
+        self.batches = self._make_batches()
+
+    def _make_batches(self):
+        rng = random.Random(f"{self.seed}-{self.epoch}")
+        indices = list(range(len(self.lengths)))
+
+        if self.shuffle:
+            rng.shuffle(indices)
+
+        batches = []
+
+        for i in range(0, len(indices), self.bucket_size):
+            bucket = sorted(indices[i:i+self.bucket_size], key=lambda idx: self.lengths[idx])
+
+            if self.batch_size:
+                batches += [bucket[j:j+self.batch_size] for j in range(0, len(bucket), self.batch_size)]
+            else:
+                batch = []
+
+                for idx in bucket:
+                    # the bucket is sorted, the new example is the longest one in the batch
+                    if batch and (len(batch) + 1) * self.lengths[idx] > self.max_tokens:
+                        batches.append(batch)
+                        batch = []
+                    batch.append(idx)
+
+                if batch:
+                    batches.append(batch)
+
+        if self.shuffle:
+            rng.shuffle(batches)
+
+        if self.num_replicas > 1:
+            n_batches = len(batches) // self.num_replicas
+            batches = batches[self.rank::self.num_replicas][:n_batches]
+
+        return batches
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+        self.batches = self._make_batches()
+
+    def __iter__(self):
+        batches = self.batches
+        logger.info(f"Epoch {self.epoch}: {len(batches)} batches, padding ratio {padding_ratio(self.lengths, batches):.1%}")
+
+        # the next epoch uses a different permutation (unless set explicitly with set_epoch)
+        self.set_epoch(self.epoch + 1)
+
+        return iter(batches)
+
+    def __len__(self):
+        return len(self.batches)
+
+
+def sequential_batches(n_examples, batch_size):
+    """
+    Returns the batches of a sampler which iterates over the examples in the dataset order
+    """
+    return [list(range(i, min(i + batch_size, n_examples))) for i in range(0, n_examples, batch_size)]
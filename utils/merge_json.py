@@ -3,12 +3,52 @@
 Merge JSONs generated in parallel by generate.py
 """
 import os
+import re
 import argparse
 import logging
-import json
 import glob
 
-from utils.json_encoder import CompactJSONEncoder
+from utils.dataset_writer import DatasetWriter, read_examples
+
+logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO, datefmt='%H:%M:%S')
+logger = logging.getLogger(__name__)
+
+
+def find_shards(directory, prefix):
+    """
+    Returns a list of (start, end, path) for the shards `{prefix}-{start}-{end}.{json,jsonl}`, sorted by the game range
+    """
+    shards = []
+
+    for path in glob.glob(os.path.join(directory, f"{prefix}-*.json*")):
+        m = re.fullmatch(rf"{re.escape(prefix)}-(\d+)-(\d+)\.(json|jsonl)", os.path.basename(path))
+
+        if m:
+            shards.append((int(m.group(1)), int(m.group(2)), path))
+
+    return sorted(shards)
+
+
+def check_coverage(shards, n_games=None):
+    """
+    Checks that the game ranges of the shards cover the games 0..n_games without gaps or overlaps
+    """
+    if not shards:
+        raise ValueError("No shards found")
+
+    expected_start = 0
+
+    for start, end, path in shards:
+        if start > expected_start:
+            raise ValueError(f"Games {expected_start}-{start} are missing (next shard: {path})")
+        elif start < expected_start:
+            raise ValueError(f"Shard {path} overlaps with the previous shard (games {start}-{expected_start})")
+
+        expected_start = end
+
+    if n_games is not None and expected_start < n_games:
+        raise ValueError(f"Games {expected_start}-{n_games} are missing")
+
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
@@ -18,17 +58,23 @@ if __name__ == '__main__':
         help="Output directory.")
     parser.add_argument("--prefix", type=str, required=True,
         help="Prefix to merge.")
+    parser.add_argument("--n_games", type=int, default=None,
+        help="Number of games in the split for checking that all the games are covered by the shards.")
+    parser.add_argument("--output_format", type=str, default="json", choices=DatasetWriter.FORMATS,
+        help="Format of the merged file.")
     args = parser.parse_args()
 
-    files = glob.glob(f"{args.dir}/{args.prefix}-*.json")
-    data = []
+    shards = find_shards(args.dir, args.prefix)
+    check_coverage(shards, n_games=args.n_games)
+
+    examples_cnt = 0
 
-    for filename in files:
-        with open(filename) as f:
-            j = json.load(f)
-            data += j["data"]
+    with DatasetWriter(os.path.join(args.outdir, args.prefix), fmt=args.output_format) as writer:
+        for start, end, path in shards:
+            for example in read_examples(path):
+                writer.write(example)
+                examples_cnt += 1
 
-    with open(f"{args.outdir}/{args.prefix}.json", "w") as f:
-        s = json.dumps({"data" : data}, ensure_ascii=False, indent=4, cls=CompactJSONEncoder)
-        f.write(s)
+            logger.info(f"Merged {path} (games {start}-{end})")
 
+    logger.info(f"{examples_cnt} examples from {len(shards)} shards saved to {writer.path}")
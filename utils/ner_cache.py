@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import hashlib
+import logging
+import nltk
+import spacy
+
+logger = logging.getLogger(__name__)
+
+
+def annotate_doc(doc):
+    """
+    Returns a serializable annotation of a Spacy doc: detokenized text, tokens and named entities
+    as (text, label, start, end)
+    """
+    return {
+        "text" : doc.text,
+        "tokens" : [token.text for token in doc],
+        "ents" : [[ent.text, ent.label_, ent.start, ent.end] for ent in doc.ents]
+    }
+
+
+class NERCache:
+    """
+    On-disk cache of the NER annotations of the sentences in the Rotowire summaries.
+
+    The annotations for each game are saved in `cache_dir/key/split/game_id.json`, where `key` identifies
+    the Spacy model and its version, the enabled and disabled pipeline components, the versions of Spacy and NLTK
+    (sentence segmentation) and the version of the cache format, so that a different setup never reuses the cache.
+    Increase `VERSION` whenever the annotations or the preprocessing of the summaries (e.g. the detokenizer) change.
+    """
+    VERSION = 1
+
+    def __init__(self, cache_dir, spacy_nlp):
+        meta = spacy_nlp.meta
+        pipeline = {
+            "enabled" : list(spacy_nlp.pipe_names),
+            "disabled" : sorted(getattr(spacy_nlp, "disabled", []))
+        }
+        pipeline_hash = hashlib.sha1(json.dumps(pipeline, sort_keys=True).encode("utf-8")).hexdigest()[:8]
+        key = f"{meta['lang']}_{meta['name']}-{meta['version']}-spacy{spacy.__version__}-nltk{nltk.__version__}" \
+              f"-v{self.VERSION}-{pipeline_hash}"
+        self.path = os.path.join(cache_dir, key)
+
+    def _game_path(self, split, game_id):
+        return os.path.join(self.path, split, f"{game_id:04d}.json")
+
+    def get(self, split, game_id):
+        """
+        Returns the list of annotated sentences for the game or None if the game is not cached
+        """
+        try:
+            with open(self._game_path(split, game_id)) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def put(self, split, game_id, annotations):
+        path = self._game_path(split, game_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # write atomically, the cache may be shared by parallel jobs
+        tmp_path = path + f".tmp{os.getpid()}"
+        with open(tmp_path, "w") as f:
+            json.dump(annotations, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+import re
+import random
+from functools import lru_cache
+
+from num2words import num2words
+from text_to_num import alpha2digit
+
+# alpha2digit cannot handle "first", "second" and "third", has to be handled separately
+# replace only if surrounded by word breaks to avoid things like seconds -> 2nds
+EXTRA_ORDINALS = [(re.compile(rf"\b{k}\b"), v) for k, v in {"first" : "1st", "second" : "2nd", "third" : "3rd"}.items()]
+
+# texts without any number words (plain numbers and scores such as "14-11") are not changed by alpha2digit
+DIGITS_ONLY_RE = re.compile(r"\d+(\s*-\s*\d+)?")
+SCORE_RE = re.compile(r"\d+\s*-\s*\d+")
+NUMBER_RE = re.compile(r"\d+\w*")
+DIGITS_RE = re.compile(r"\d+")
+
+
+@lru_cache(maxsize=None)
+def parse_numbers(orig_text, mode):
+    """
+    Transform all the numbers in text to digit-only variants and find all number-like groups.
+
+    Returns a tuple (text, to_lex, numbers) where `to_lex` denotes whether some numbers
+    in lexical form were transformed to digits and `numbers` is a tuple of (number, start, end).
+    """
+    if DIGITS_ONLY_RE.fullmatch(orig_text):
+        text = orig_text
+    else:
+        text = alpha2digit(orig_text, "en")
+
+    if mode == "ordinal":
+        for pattern, repl in EXTRA_ORDINALS:
+            text = pattern.sub(repl, text)
+
+    to_lex = (orig_text != text)
+    numbers = tuple((int(DIGITS_RE.search(m.group(0)).group(0)), m.start(0), m.end(0)) for m in NUMBER_RE.finditer(text))
+
+    return text, to_lex, numbers
+
+
+@lru_cache(maxsize=None)
+def number_to_words(num, mode):
+    return num2words(num, to=mode)
+
+
+def modify_numbers(orig_text, mode="cardinal"):
+    """
+    Modify numbers (integers) based on the mode (cardinal / ordinal). Gaussian noise with a cut-off at
+    zero is applied until the number is different from the original number.
+
+    If `orig_text` contains non-digit numbers, alpha2digit is used to transform all the numbers
+    in text to digit-only variants and transformed back to text after modifications.
+
+    The parsing and the conversions between digits and words are memoized, the random generator
+    is called in the same order as without the memoization, so the output is identical for a given seed.
+    """
+    text, to_lex, numbers = parse_numbers(str(orig_text), mode)
+    chars = [ch for ch in text]
+
+    for num, start, end in numbers:
+        modified_num = num
+
+        # apply Gaussian noise with sigma=3 until the number differs
+        # negative numbers do not occur in texts -> threshold at zero
+        while modified_num == num:
+            modified_num = max(0, int(random.gauss(num, 3)))
+
+        if to_lex:
+            modified_num = number_to_words(modified_num, mode)
+
+        chars[start:end] = [ch for ch in str(modified_num)]
+
+    return "".join(chars)
@@ -3,22 +3,156 @@
 import json
 import os
 import argparse
+import logging
+import mmap
+import struct
+import zlib
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+
+STORE_MAGIC = b"RWSTORE2"
+
+
+def game_entities(game):
+    """
+    Returns the names of the teams and the players in a game
+    """
+    return {
+        "teams" : [
+            game["home_city"] + " " + game["home_name"],
+            game["vis_city"] + " " + game["vis_name"]
+        ],
+        "players" : list(game["box_score"]["PLAYER_NAME"].values())
+    }
+
+
+def convert_split(json_path, store_path):
+    """
+    One-time conversion of a Rotowire split to a compact store with random access to the games.
+
+    The store consists of a magic string identifying the format, the number of games N, N+1 offsets of the game records,
+    N+1 offsets of the entity records, the game records (zlib-compressed JSON) and the entity records (JSON with the names
+    of the teams and the players). The box scores are saved column-oriented, i.e. as lists of values for each column.
+    The entity records are kept separately, so that the entities of a game can be read without decoding the whole game.
+    """
+    logger.info(f"Converting {json_path} to {store_path}")
+
+    with open(json_path) as f:
+        games = json.load(f)
+
+    records = []
+    entity_records = []
+
+    for game in games:
+        entity_records.append(json.dumps(game_entities(game), ensure_ascii=False).encode("utf-8"))
+        game = dict(game)
+        game["box_score"] = {column : list(values.values()) for column, values in game["box_score"].items()}
+        records.append(zlib.compress(json.dumps(game, ensure_ascii=False).encode("utf-8")))
+
+    header_size = len(STORE_MAGIC) + 8 + 2 * 8 * (len(records) + 1)
+    offsets = [header_size]
+
+    for record in records + entity_records:
+        offsets.append(offsets[-1] + len(record))
+
+    # the game records are followed by the entity records, the last game offset is the first entity offset
+    record_offsets = offsets[:len(records)+1]
+    entity_offsets = offsets[len(records):]
+    tmp_path = store_path + f".tmp{os.getpid()}"
+
+    with open(tmp_path, "wb") as f:
+        f.write(STORE_MAGIC)
+        f.write(struct.pack("<Q", len(records)))
+        f.write(struct.pack(f"<{len(record_offsets)}Q", *record_offsets))
+        f.write(struct.pack(f"<{len(entity_offsets)}Q", *entity_offsets))
+
+        for record in records + entity_records:
+            f.write(record)
+
+    os.replace(tmp_path, store_path)
+
+
+def is_current(store_path, json_path):
+    """
+    Checks that the store exists, has the current format and is not older than the source JSON (if it exists)
+    """
+    if not os.path.exists(store_path):
+        return False
+
+    with open(store_path, "rb") as f:
+        if f.read(len(STORE_MAGIC)) != STORE_MAGIC:
+            return False
+
+    # the source JSON may be removed after the conversion
+    return not os.path.exists(json_path) or os.path.getmtime(store_path) >= os.path.getmtime(json_path)
+
 
 class Rotowire:
-    def __init__(self, rotowire_dir, split):
-        with open(os.path.join(rotowire_dir, f"{split}.json")) as f:
-            self.games = json.load(f)
+    """
+    Lazy access to the games in a Rotowire split. The split is converted to a compact store
+    on the first use (see `convert_split`) and each game is decoded only when accessed.
+    The names of the teams and the players are read from the separate entity records.
+
+    The last `cache_size` decoded games are cached for each instance. The cached dictionaries are
+    shared between the callers and must be treated as read-only.
+    """
+    def __init__(self, rotowire_dir, split, cache_size=32):
+        self.split = split
+        json_path = os.path.join(rotowire_dir, f"{split}.json")
+        store_path = os.path.join(rotowire_dir, f"{split}.store")
+
+        if not is_current(store_path, json_path):
+            if not os.path.exists(json_path):
+                raise FileNotFoundError(f"{store_path} has an outdated format and {json_path} is not available for the conversion")
+            convert_split(json_path, store_path)
+
+        with open(store_path, "rb") as f:
+            self.store = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        header = len(STORE_MAGIC)
+        self.n_games = struct.unpack_from("<Q", self.store, header)[0]
+        self.offsets = struct.unpack_from(f"<{self.n_games+1}Q", self.store, header + 8)
+        self.entity_offsets = struct.unpack_from(f"<{self.n_games+1}Q", self.store, header + 8 + 8 * (self.n_games+1))
+        self._get = lru_cache(maxsize=cache_size)(self._load)
+
+    def __len__(self):
+        return self.n_games
+
+    def _check_id(self, game_id):
+        if not 0 <= game_id < self.n_games:
+            raise IndexError(f"Game id {game_id} out of range")
+
+    def _load(self, game_id):
+        self._check_id(game_id)
+        record = self.store[self.offsets[game_id]:self.offsets[game_id+1]]
+
+        return json.loads(zlib.decompress(record).decode("utf-8"))
+
+    def __getitem__(self, game_id):
+        """
+        Returns the decoded game (read-only)
+        """
+        return self._get(game_id)
+
+    def get_entities(self, game_id):
+        """
+        Returns the names of the teams and the players in the game (see `game_entities`) without decoding the game
+        """
+        self._check_id(game_id)
+        record = self.store[self.entity_offsets[game_id]:self.entity_offsets[game_id+1]]
+
+        return json.loads(record.decode("utf-8"))
+
+    def get_summary(self, game_id):
+        return list(self[game_id]["summary"])
 
     def get_players(self, game_id):
-        return list(self.games[game_id]["box_score"]["PLAYER_NAME"].values())
+        return self.get_entities(game_id)["players"]
 
     def get_teams(self, game_id):
-        game = self.games[game_id]
-
-        return [
-           game["home_city"] + " " + game["home_name"],
-           game["vis_city"] + " " + game["vis_name"]
-        ]
+        return self.get_entities(game_id)["teams"]
 
 def extract_cities(j):
     cities = set()
@@ -36,14 +170,20 @@ def extract_cities(j):
 
     return cities
 
-    
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--rotowire_dir", type=str, required=True,
         help="Path to the original Rotowire dataset.")
+    parser.add_argument("--convert", action="store_true",
+        help="Only convert all the splits to the compact store.")
     args = parser.parse_args()
 
-    with open(os.path.join(rotowire_dir, "train.json")) as f:
-        j = json.load(f)
+    if args.convert:
+        for split in ["train", "dev", "test"]:
+            convert_split(os.path.join(args.rotowire_dir, f"{split}.json"), os.path.join(args.rotowire_dir, f"{split}.store"))
+    else:
+        with open(os.path.join(args.rotowire_dir, "train.json")) as f:
+            j = json.load(f)
 
-    extract_cities(j)
+        extract_cities(j)
@@ -2,36 +2,172 @@
 
 import sys
 import os
-from sentence_transformers import SentenceTransformer, util
+import torch
+from collections import OrderedDict
+from utils.embedding_store import EmbeddingStore
+from utils.bm25_scorer import BM25Scorer
+from sentence_transformers import SentenceTransformer
+
+
+class CompactEmbeddings:
+    """
+    Normalized sentence embeddings stored in a reduced precision:
+
+    fp32 - no compression
+    fp16 - half precision
+    int8 - scalar quantization with a scale for each vector (the dequantized vector has a unit norm)
+
+    Since the vectors are normalized, cosine similarity is computed as a dot product with the
+    normalized query embeddings.
+    """
+    PRECISIONS = ["fp32", "fp16", "int8"]
+
+    def __init__(self, values, scales=None):
+        self.values = values
+        self.scales = scales
+
+    @classmethod
+    def from_tensor(cls, emb, precision="fp32"):
+        emb = torch.nn.functional.normalize(emb.float(), dim=-1)
+
+        if precision == "fp32":
+            return cls(emb)
+        elif precision == "fp16":
+            return cls(emb.half())
+        elif precision == "int8":
+            max_abs = emb.abs().max(dim=-1, keepdim=True).values.clamp(min=1e-12)
+            values = torch.round(emb * 127 / max_abs).to(torch.int8)
+            scales = 1 / values.float().norm(dim=-1).clamp(min=1e-12)
+            return cls(values, scales)
+        else:
+            raise ValueError(f"Unknown precision {precision}, use one of {cls.PRECISIONS}")
+
+    def __len__(self):
+        return self.values.shape[0]
+
+    def __getitem__(self, idx):
+        return CompactEmbeddings(self.values[idx], self.scales[idx] if self.scales is not None else None)
+
+    @property
+    def nbytes(self):
+        nbytes = self.values.element_size() * self.values.nelement()
+
+        if self.scales is not None:
+            nbytes += self.scales.element_size() * self.scales.nelement()
+
+        return nbytes
+
+    def cos_sim(self, emb_sents):
+        """
+        Returns the (sentences x texts) cosine similarity matrix
+        """
+        emb_sents = torch.nn.functional.normalize(emb_sents.float(), dim=-1)
+
+        if self.values.dtype == torch.float16 and self.values.is_cuda:
+            scores = (emb_sents.half() @ self.values.T).float()
+        else:
+            # half and integer matrix multiplication is not available on CPU,
+            # the compact values are upcast only for the duration of the product
+            scores = emb_sents @ self.values.float().T
+
+        if self.scales is not None:
+            scores = scores * self.scales
+
+        return scores
+
 
 class SentenceScorer:
     """
     Use sentence embeddings and cosine similarity to retrieve relevant
-    sentences out of all sentences generated for a game. 
+    sentences out of all sentences generated for a game.
+
+    Embeddings of the sentences generated for a game are computed only once and kept
+    in a LRU cache holding at most `cache_size` games (0 disables the cache).
+    If an embedding store is loaded for the games, the embeddings are read from the store instead.
+    The embeddings are kept in the memory in the given `precision` (fp32 / fp16 / int8).
     """
-    def __init__(self):
-        self.model = SentenceTransformer('paraphrase-distilroberta-base-v2')
+    def __init__(self, cache_size=128, model_name='paraphrase-distilroberta-base-v2', precision="fp32"):
+        self.model_name = model_name
+        self.model = SentenceTransformer(model_name)
+        self.precision = precision
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.stores = {}
 
-    def score(self, texts, sentence):
-        emb_texts = self.model.encode(texts, convert_to_tensor=True, show_progress_bar=False)
-        emb_sent = self.model.encode(sentence, convert_to_tensor=True, show_progress_bar=False)
-        
-        # efficient N-to-1 computation
-        emb_sent = emb_sent.repeat(len(texts)).view(len(texts),-1)
+    def load_store(self, store_dir, template_path, split, games):
+        """
+        Load the on-disk embedding store for the games, build the store first if it
+        does not exist or the template file has changed.
+        """
+        templates = os.path.basename(os.path.normpath(template_path))
+        template_file = os.path.join(template_path, f"{split}.txt")
+        store = EmbeddingStore(store_dir, self.model_name, templates, split)
 
-        scores = util.pytorch_cos_sim(emb_texts, emb_sent).diag()
-        scored_sentences = list(sorted(zip(texts, scores), key=lambda x: x[1], reverse=True))
+        if not store.is_valid(template_file):
+            store.build(games, self.model, template_file)
 
-        return scored_sentences
+        store.load()
+        self.stores[(templates, split)] = store
 
-    def retrieve_ctx_scored(self, sentence, game_data, cnt):
+    def encode_texts(self, game_data):
         """
-        Returns a list of tuples (sentence, sim_score)
+        Returns the embeddings of all sentences generated for a game
+        """
+        if game_data in self.cache:
+            self.cache.move_to_end(game_data)
+            return self.cache[game_data]
+
+        store = self.stores.get((game_data.templates, game_data.split))
+
+        if store is not None:
+            # copy the slice from the read-only memory-mapped store
+            emb_texts = torch.tensor(store.get(game_data.game_id), device=self.model.device)
+        else:
+            emb_texts = self.model.encode(game_data.get_all(), convert_to_tensor=True, show_progress_bar=False)
+
+        emb_texts = CompactEmbeddings.from_tensor(emb_texts, self.precision)
+
+        if self.cache_size > 0:
+            self.cache[game_data] = emb_texts
+
+            if len(self.cache) > self.cache_size:
+                # evict the least recently used game
+                self.cache.popitem(last=False)
+
+        return emb_texts
+
+    def score(self, texts, sentences, cnt, emb_texts=None):
+        """
+        Score the texts for each of the sentences, returns `cnt` best scored texts for each sentence
+        """
+        if emb_texts is None:
+            emb_texts = self.model.encode(texts, convert_to_tensor=True, show_progress_bar=False)
+            emb_texts = CompactEmbeddings.from_tensor(emb_texts, self.precision)
+        emb_sents = self.model.encode(sentences, convert_to_tensor=True, show_progress_bar=False)
+
+        # (sentences x texts) similarity matrix
+        scores = emb_texts.cos_sim(emb_sents)
+        top_scores, top_indices = torch.topk(scores, k=min(cnt, len(texts)), dim=1)
+
+        return [
+            [(texts[idx], score) for idx, score in zip(indices, sent_scores)]
+            for indices, sent_scores in zip(top_indices.tolist(), top_scores.tolist())
+        ]
+
+    def retrieve_ctx_scored_batch(self, sentences, game_data, cnt):
+        """
+        Returns a list of tuples (sentence, sim_score) for each of the sentences
         """
         texts = game_data.get_all()
-        scored_sentences = self.score(sentence=sentence, texts=texts)
+        emb_texts = self.encode_texts(game_data)
 
-        return scored_sentences[:cnt]
+        return self.score(texts=texts, sentences=sentences, cnt=cnt, emb_texts=emb_texts)
+
+    def retrieve_ctx_scored(self, sentence, game_data, cnt):
+        """
+        Returns a list of tuples (sentence, sim_score)
+        """
+        return self.retrieve_ctx_scored_batch([sentence], game_data, cnt)[0]
 
     def retrieve_ctx(self, sentence, game_data, cnt):
         """
@@ -40,4 +176,73 @@ class SentenceScorer:
         scored_sentences = self.retrieve_ctx_scored(sentence, game_data, cnt)
         text = " ".join([x[0] for x in scored_sentences])
 
-        return text
\ No newline at end of file
+        return text
+
+
+class HybridScorer(SentenceScorer):
+    """
+    Select `n_candidates` sentences using BM25 and re-score the candidates with sentence embeddings.
+
+    Only the candidates are encoded (the union of the candidates for all the sentences in the batch),
+    if an embedding store is loaded for the games, the embeddings of the candidates are read from the store.
+    """
+    def __init__(self, n_candidates=100, **kwargs):
+        super().__init__(**kwargs)
+        self.n_candidates = n_candidates
+        self.sparse = BM25Scorer(cache_size=self.cache_size)
+
+    def encode_candidates(self, game_data, candidate_ids):
+        """
+        Returns the embeddings of the sentences generated for a game with the given indices
+        """
+        store = self.stores.get((game_data.templates, game_data.split))
+
+        if store is not None:
+            emb_texts = torch.tensor(store.get(game_data.game_id)[candidate_ids], device=self.model.device)
+        else:
+            texts = game_data.get_all()
+            emb_texts = self.model.encode([texts[idx] for idx in candidate_ids], convert_to_tensor=True, show_progress_bar=False)
+
+        return CompactEmbeddings.from_tensor(emb_texts, self.precision)
+
+    def retrieve_ctx_scored_batch(self, sentences, game_data, cnt):
+        texts = game_data.get_all()
+        candidates_batch = self.sparse.rank(sentences, game_data, max(cnt, self.n_candidates))
+        candidate_ids = sorted({idx for candidates in candidates_batch for idx, _ in candidates})
+
+        if not candidate_ids:
+            return [[] for _ in sentences]
+
+        emb_candidates = self.encode_candidates(game_data, candidate_ids)
+        emb_positions = {idx : pos for pos, idx in enumerate(candidate_ids)}
+        emb_sents = self.model.encode(sentences, convert_to_tensor=True, show_progress_bar=False)
+        scored_sentences_batch = []
+
+        for emb_sent, candidates in zip(emb_sents, candidates_batch):
+            ids = [idx for idx, _ in candidates]
+            scores = emb_candidates[[emb_positions[idx] for idx in ids]].cos_sim(emb_sent.unsqueeze(0))[0]
+            top_scores, top_indices = torch.topk(scores, k=min(cnt, len(ids)))
+
+            scored_sentences_batch.append([
+                (texts[ids[idx]], score) for idx, score in zip(top_indices.tolist(), top_scores.tolist())
+            ])
+
+        return scored_sentences_batch
+
+
+RETRIEVERS = {
+    "dense" : SentenceScorer,
+    "bm25" : BM25Scorer,
+    "hybrid" : HybridScorer
+}
+
+
+def get_scorer(retriever="dense", precision="fp32"):
+    """
+    Returns a scorer for retrieving the context: dense (sentence embeddings), bm25 (sparse),
+    or hybrid (BM25 candidates re-scored with sentence embeddings)
+    """
+    if retriever == "bm25":
+        return BM25Scorer()
+
+    return RETRIEVERS[retriever](precision=precision)
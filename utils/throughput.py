@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import time
+import logging
+import resource
+
+import torch
+import pytorch_lightning as pl
+
+logger = logging.getLogger(__name__)
+
+
+def peak_memory_mb():
+    """
+    Returns the peak memory allocated on the GPU, or the peak resident memory of the process if running on CPU (in MB)
+    """
+    if torch.cuda.is_available() and torch.cuda.is_initialized():
+        return torch.cuda.max_memory_allocated() / 2**20
+
+    # kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+
+
+class ThroughputMonitor(pl.Callback):
+    """
+    Logs the training throughput for each step: tokens per second, real (non-padding) and padded tokens in the batch,
+    time spent waiting for the data loader and in the training step (forward, backward and optimizer step)
+    and the peak memory. The totals for the whole run are saved in a JSON summary at the end of the training.
+    """
+    def __init__(self, summary_path):
+        self.summary_path = summary_path
+        self.step_start = None
+        self.prev_step_end = None
+        self.stats = {
+            "steps" : 0,
+            "examples" : 0,
+            "real_tokens" : 0,
+            "padded_tokens" : 0,
+            "data_time" : 0.0,
+            "step_time" : 0.0
+        }
+
+    def on_train_epoch_start(self, trainer, pl_module):
+        self.prev_step_end = time.perf_counter()
+
+    def on_train_batch_start(self, trainer, pl_module, batch, batch_idx, dataloader_idx):
+        self.step_start = time.perf_counter()
+        self.data_time = self.step_start - self.prev_step_end
+
+    def on_train_batch_end(self, trainer, pl_module, outputs, batch, batch_idx, dataloader_idx):
+        # .item() waits for the step to finish on the GPU
+        real_tokens = batch["attention_mask"].sum().item()
+        padded_tokens = batch["attention_mask"].numel()
+
+        self.prev_step_end = time.perf_counter()
+        step_time = self.prev_step_end - self.step_start
+
+        self.stats["steps"] += 1
+        self.stats["examples"] += len(batch["attention_mask"])
+        self.stats["real_tokens"] += real_tokens
+        self.stats["padded_tokens"] += padded_tokens
+        self.stats["data_time"] += self.data_time
+        self.stats["step_time"] += step_time
+
+        pl_module.log("throughput/tokens_per_sec", real_tokens / (self.data_time + step_time))
+        pl_module.log("throughput/real_tokens", float(real_tokens))
+        pl_module.log("throughput/padded_tokens", float(padded_tokens))
+        pl_module.log("throughput/data_time", self.data_time)
+        pl_module.log("throughput/step_time", step_time)
+        pl_module.log("throughput/peak_memory_mb", peak_memory_mb())
+
+    def on_train_end(self, trainer, pl_module):
+        if not trainer.is_global_zero:
+            return
+
+        total_time = self.stats["data_time"] + self.stats["step_time"]
+        summary = {
+            **self.stats,
+            "world_size" : trainer.world_size,
+            "tokens_per_sec" : self.stats["real_tokens"] / total_time if total_time else 0.0,
+            "examples_per_sec" : self.stats["examples"] / total_time if total_time else 0.0,
+            "padding_ratio" : 1 - self.stats["real_tokens"] / self.stats["padded_tokens"] if self.stats["padded_tokens"] else 0.0,
+            "data_time_ratio" : self.stats["data_time"] / total_time if total_time else 0.0,
+            "peak_memory_mb" : peak_memory_mb()
+        }
+
+        os.makedirs(os.path.dirname(self.summary_path) or ".", exist_ok=True)
+
+        with open(self.summary_path, "w") as f:
+            json.dump(summary, f, indent=4)
+
+        logger.info(f"Throughput summary (process 0) saved to {self.summary_path}: {summary['tokens_per_sec']:.1f} tokens/s, "
+                    f"padding ratio {summary['padding_ratio']:.1%}, data loading {summary['data_time_ratio']:.1%} of the time")
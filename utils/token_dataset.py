@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+"""
+Pre-tokenized binary datasets for training the model without tokenizing the examples in every run
+"""
+import os
+import json
+import shutil
+import logging
+import argparse
+import hashlib
+import tempfile
+
+import numpy as np
+import torch
+
+from utils.utils import Label
+from utils.dataset_writer import read_examples
+from utils.embedding_store import file_hash
+
+logger = logging.getLogger(__name__)
+
+DO_NOT_CARE_LABEL = -100
+
+DTYPES = {
+    "input_ids" : "int32",
+    "attention_mask" : "uint8",
+    "labels" : "int8"
+}
+
+
+def tokenized_path(path, model_name, max_length, ctx_size=None):
+    """
+    Returns the path of the tokenized dataset for the split saved at `path` (without the extension)
+    """
+    ctx_suffix = f"-ctx{ctx_size}" if ctx_size else ""
+
+    return f"{path}.{model_name.replace('/', '_')}-{max_length}{ctx_suffix}.tok"
+
+
+def source_stat(path):
+    """
+    Returns the size and the modification time of the data file the tokenized dataset was created from
+    """
+    stat = os.stat(path)
+
+    return {"size" : stat.st_size, "mtime_ns" : stat.st_mtime_ns}
+
+
+def select_ctx(example_batch, ctx_size=None):
+    """
+    Returns the context tokens for the examples in the batch. For the datasets with the ranked context
+    sentences ("ctx_sents"), the context consists of the first `ctx_size` sentences (all if None).
+    """
+    if "ctx_sents" not in example_batch:
+        return example_batch["ctx"]
+
+    return [[token for sent in ctx_sents[:ctx_size] for token in sent] for ctx_sents in example_batch["ctx_sents"]]
+
+
+def convert_to_features(tokenizer, example_batch, max_length, ctx_size=None):
+    ctx = select_ctx(example_batch, ctx_size)
+    sent = example_batch["sent"]
+
+    features = tokenizer(ctx, sent,
+        is_split_into_words=True,
+        return_offsets_mapping=True,
+        max_length=max_length,
+        truncation='only_first')
+
+    features['labels'] = align_labels_with_tokens(tokenizer,
+        features, example_batch['labels'])
+
+    return features
+
+
+def align_labels_with_tokens(tokenizer, features, labels):
+    """
+    Align the word labels with the subword tokens. The label of a word is assigned to its first token
+    in the hypothesis, i.e. after the double separator (`</s></s>`) following the context. All the other
+    tokens get the label which is ignored in the loss.
+
+    The word ids are fetched once per example and the alignment is computed with array operations.
+    """
+    aligned_labels_batch = []
+    label_map = Label.label2id()
+
+    for b in range(len(labels)):
+        input_ids = np.asarray(features["input_ids"][b])
+        # word is None for BOS, EOS and separators
+        words = np.array([-1 if word is None else word for word in features.word_ids(b)], dtype=np.int64)
+        aligned_labels = np.full(len(input_ids), DO_NOT_CARE_LABEL, dtype=np.int64)
+
+        # compute loss only for the hypothesis, skip the context
+        is_sep = (input_ids == tokenizer.sep_token_id)
+        sep_pairs = np.flatnonzero(is_sep[1:] & is_sep[:-1])
+
+        if len(sep_pairs) > 0:
+            start = sep_pairs[0] + 2
+            # align with word in case a new word started
+            new_word = (words[start:] != -1) & (words[start:] != words[start-1:-1])
+            positions = start + np.flatnonzero(new_word)
+            word_labels = np.array([label_map[label] for label in labels[b]], dtype=np.int64)
+            aligned_labels[positions] = word_labels[words[positions]]
+
+        aligned_labels_batch.append(aligned_labels.tolist())
+
+    return aligned_labels_batch
+
+
+class TokenizedDatasetWriter:
+    """
+    Tokenizes the examples in batches and writes `input_ids`, `attention_mask` and aligned `labels` as flat
+    binary arrays, the offsets of the examples are saved together with the metadata on closing.
+
+    The dataset is written to a temporary directory and moved to `path` only when complete (if the writer
+    is used as a context manager and an exception is raised, the dataset is discarded). If `overwrite` is False
+    and the dataset at `path` already exists (e.g. it was written by a concurrent job), the existing dataset is kept.
+
+    If `source_path` is given, the size and the modification time of the source data file (which has to be
+    complete when the writer is closed) are saved in the metadata, so that the dataset is not used if the data file changes.
+    """
+    def __init__(self, path, tokenizer, max_length, ctx_size=None, batch_size=1000, overwrite=True, source_path=None):
+        self.path = path
+        self.source_path = source_path
+        self.overwrite = overwrite
+        self.tokenizer = tokenizer
+        self.max_length = max_length
+        self.ctx_size = ctx_size
+        self.batch_size = batch_size
+        self.batch = []
+        self.offsets = [0]
+
+        parent_dir = os.path.dirname(os.path.abspath(path))
+        os.makedirs(parent_dir, exist_ok=True)
+        self.tmp_path = tempfile.mkdtemp(dir=parent_dir, prefix=os.path.basename(path) + ".tmp")
+        self.files = {key : open(os.path.join(self.tmp_path, f"{key}.bin"), "wb") for key in DTYPES}
+
+    def write(self, example):
+        self.batch.append(example)
+
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def write_all(self, examples):
+        for example in examples:
+            self.write(example)
+
+    def flush(self):
+        if not self.batch:
+            return
+
+        example_batch = {key : [example[key] for example in self.batch] for key in self.batch[0]}
+        features = convert_to_features(self.tokenizer, example_batch, self.max_length, self.ctx_size)
+
+        for b in range(len(self.batch)):
+            for key, dtype in DTYPES.items():
+                self.files[key].write(np.asarray(features[key][b], dtype=dtype).tobytes())
+
+            self.offsets.append(self.offsets[-1] + len(features["input_ids"][b]))
+
+        self.batch = []
+
+    def close(self):
+        self.flush()
+
+        for f in self.files.values():
+            f.close()
+
+        np.asarray(self.offsets, dtype="int64").tofile(os.path.join(self.tmp_path, "offsets.bin"))
+
+        meta = {
+            "model_name" : self.tokenizer.name_or_path,
+            "vocab_size" : len(self.tokenizer),
+            "max_length" : self.max_length,
+            "ctx_size" : self.ctx_size,
+            "label2id" : Label.label2id(),
+            "n_examples" : len(self.offsets) - 1,
+            "n_tokens" : self.offsets[-1],
+            "dtypes" : DTYPES,
+            "source" : source_stat(self.source_path) if self.source_path else None
+        }
+        with open(os.path.join(self.tmp_path, "meta.json"), "w") as f:
+            json.dump(meta, f, indent=4)
+
+        if os.path.exists(self.path) and self.overwrite:
+            shutil.rmtree(self.path)
+
+        try:
+            os.replace(self.tmp_path, self.path)
+        except OSError:
+            if self.overwrite or not os.path.exists(self.path):
+                raise
+            # the same dataset was completed by another job in the meantime
+            shutil.rmtree(self.tmp_path)
+
+    def abort(self):
+        """
+        Discards the partially written dataset, nothing is saved to `path`
+        """
+        for f in self.files.values():
+            f.close()
+
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # an incomplete dataset is never published
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+
+class TokenizedDataset(torch.utils.data.Dataset):
+    """
+    Memory-mapped tokenized dataset written by `TokenizedDatasetWriter`, the items are the same as
+    for the Huggingface dataset with the torch format used in `ErrorCheckerDataModule`
+    """
+    def __init__(self, path):
+        self.path = path
+
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+
+        self._open()
+
+    def _open(self):
+        self.offsets = np.fromfile(os.path.join(self.path, "offsets.bin"), dtype="int64")
+        self.arrays = {
+            key : np.memmap(os.path.join(self.path, f"{key}.bin"), dtype=dtype, mode="r", shape=(self.meta["n_tokens"],))
+            if self.meta["n_tokens"] > 0 else np.zeros(0, dtype=dtype)
+            for key, dtype in self.meta["dtypes"].items()
+        }
+
+    def __getstate__(self):
+        # the arrays are memory-mapped again in the worker processes instead of being copied
+        return {"path" : self.path, "meta" : self.meta}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._open()
+
+    @staticmethod
+    def is_valid(path, tokenizer, max_length, source_path=None):
+        """
+        Checks that the dataset at `path` was created with the same tokenizer, maximum length and labels.
+        If `source_path` is given and exists, also checks that the dataset was created from the current version of the data file.
+        """
+        try:
+            with open(os.path.join(path, "meta.json")) as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            return False
+
+        if source_path is not None and os.path.exists(source_path) and meta.get("source") != source_stat(source_path):
+            logger.info(f"Pre-tokenized dataset {path} was created from a different version of {source_path}, not used")
+            return False
+
+        return meta["model_name"] == tokenizer.name_or_path \
+            and meta["vocab_size"] == len(tokenizer) \
+            and meta["max_length"] == max_length \
+            and meta["label2id"] == Label.label2id()
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def lengths(self):
+        """
+        Returns the number of tokens in each example
+        """
+        return np.diff(self.offsets).tolist()
+
+    def __getitem__(self, idx):
+        start, end = self.offsets[idx], self.offsets[idx+1]
+
+        return {key : torch.from_numpy(array[start:end].astype("int64")) for key, array in self.arrays.items()}
+
+
+class TokenizationCache:
+    """
+    On-disk cache of the tokenized splits shared across the experiments.
+
+    The splits are saved as pre-tokenized datasets in `cache_dir/key`, where the key is a hash
+    of the contents of the data file, the tokenizer (name, version and vocabulary size), the maximum length
+    and the labels. A change in any of these results in a new entry. The entries are created atomically,
+    so the cache can be used by concurrent jobs.
+    """
+    VERSION = 1
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def key(self, data_path, tokenizer, max_length, ctx_size=None):
+        import transformers
+
+        fingerprint = {
+            "version" : self.VERSION,
+            "data" : file_hash(data_path),
+            "tokenizer" : tokenizer.name_or_path,
+            "tokenizer_class" : type(tokenizer).__name__,
+            "transformers" : transformers.__version__,
+            "vocab_size" : len(tokenizer),
+            "max_length" : max_length,
+            "ctx_size" : ctx_size,
+            "label2id" : Label.label2id()
+        }
+        return hashlib.sha1(json.dumps(fingerprint, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def get(self, data_path, tokenizer, max_length, ctx_size=None):
+        """
+        Returns the tokenized dataset for the data file, the dataset is created on a cache miss
+        """
+        path = os.path.join(self.cache_dir, self.key(data_path, tokenizer, max_length, ctx_size))
+
+        if TokenizedDataset.is_valid(path, tokenizer, max_length):
+            logger.info(f"Tokenization cache hit for {data_path} ({path})")
+        else:
+            logger.info(f"Tokenization cache miss for {data_path}, tokenizing to {path}")
+
+            with TokenizedDatasetWriter(path, tokenizer, max_length, ctx_size, overwrite=False) as writer:
+                writer.write_all(read_examples(data_path))
+
+        return TokenizedDataset(path)
+
+
+if __name__ == "__main__":
+    from transformers import AutoTokenizer
+
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO, datefmt='%H:%M:%S')
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dataset", type=str, required=True,
+        help="Dataset name (a directory in `data`).")
+    parser.add_argument("--model_name", type=str, default="roberta-base",
+        help="Name of the model from the Huggingface Transformers library.")
+    parser.add_argument("--max_length", type=int, default=512,
+        help="Maximum number of tokens per example")
+    parser.add_argument("--splits", type=str, nargs="+", default=["train", "dev", "test"],
+        help="Splits to convert.")
+    parser.add_argument("--ctx", type=int, default=None,
+        help="Number of context sentences kept for the datasets with the ranked context sentences (all by default).")
+    args = parser.parse_args()
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model_name, use_fast=True, add_prefix_space=True)
+
+    for split in args.splits:
+        path = os.path.join("data", args.dataset, split)
+        src_path = next((p for p in [f"{path}.jsonl", f"{path}.json"] if os.path.exists(p)), None)
+
+        if src_path is None:
+            logger.warning(f"Split {split} not found in {args.dataset}, skipping")
+            continue
+
+        with TokenizedDatasetWriter(tokenized_path(path, args.model_name, args.max_length, args.ctx),
+                                    tokenizer, args.max_length, args.ctx, source_path=src_path) as writer:
+            writer.write_all(read_examples(src_path))
+
+        logger.info(f"{len(writer.offsets) - 1} examples from {src_path} saved to {writer.path}")
@@ -23,13 +23,39 @@ class Label(Enum):
         return {label.value : label.name for label in cls}
 
 
-def random_choice_neq(l, neq_to):
+class SubstitutionTable:
     """
-    Return a random element from a list. The element is different from the given element `neq_to`.
+    Frozen table of values (e.g. player names) used for substituting an entity with a different value.
+    The tokenized forms of the values are precomputed and a value different from the given one
+    is sampled in constant time.
     """
-    assert any([el != neq_to for el in l]), f"Cannot select element not equal to {neq_to} in {l}"
+    __slots__ = ["values", "tokens", "index"]
 
-    while True:
-        choice = random.choice(l)
-        if choice != neq_to:
-            return choice
\ No newline at end of file
+    def __init__(self, values, tokenize=None):
+        self.values = tuple(dict.fromkeys(values))
+        self.tokens = tuple(tuple(tokenize(value)) if tokenize else (value,) for value in self.values)
+        self.index = {value : i for i, value in enumerate(self.values)}
+
+    def __contains__(self, value):
+        return value in self.index
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __len__(self):
+        return len(self.values)
+
+    def sample_neq(self, neq_to):
+        """
+        Return a random value different from the given value `neq_to` and its tokens.
+        """
+        neq_idx = self.index.get(neq_to)
+        n_candidates = len(self.values) - (neq_idx is not None)
+        assert n_candidates > 0, f"Cannot select element not equal to {neq_to} in {self.values}"
+
+        # skip over the excluded value
+        idx = random.randrange(n_candidates)
+        if neq_idx is not None and idx >= neq_idx:
+            idx += 1
+
+        return self.values[idx], self.tokens[idx]